@@ -0,0 +1,55 @@
+import gevent
+import gevent.pool
+import pymongo
+from mongosync.logger import Logger
+
+log = Logger.get()
+
+
+class CollStats(object):
+    """ Metadata of a collection from command 'collstats'.
+
+    count is the estimated count recorded in metadata.
+    """
+    def __init__(self, namespace_tuple, collstats):
+        self.namespace_tuple = namespace_tuple
+        self.collstats = collstats
+        self.count = collstats.get('count', 0)
+        self.size = collstats.get('size', 0)
+        self.avg_obj_size = collstats.get('avgObjSize', 0)
+        self.storage_size = collstats.get('storageSize', 0)
+        self.n_indexes = collstats.get('nindexes', 0)
+
+    @property
+    def empty(self):
+        return 'avgObjSize' not in self.collstats or self.count == 0
+
+
+class CollStatsCache(object):
+    """ Cache of collection metadata for initial sync planning.
+    """
+    def __init__(self):
+        self._map = {}  # namespace_tuple => CollStats
+
+    def load(self, client, colls, concurrency=16):
+        """ Fetch metadata of collections concurrently.
+        """
+        def fetch(ns_tuple):
+            dbname, collname = ns_tuple
+            try:
+                collstats = client[dbname].command('collstats', collname)
+            except pymongo.errors.OperationFailure as e:
+                # dropped after listed
+                log.warn('collstats %s.%s failed: %s' % (dbname, collname, e))
+                collstats = {}
+            return CollStats(ns_tuple, collstats)
+
+        pool = gevent.pool.Pool(concurrency)
+        for stats in pool.imap_unordered(fetch, [ns for ns in colls if ns not in self._map]):
+            self._map[stats.namespace_tuple] = stats
+
+    def get(self, namespace_tuple):
+        return self._map[namespace_tuple]
+
+    def __contains__(self, namespace_tuple):
+        return namespace_tuple in self._map
@@ -28,6 +28,7 @@ class CommandOptions(object):
         parser.add_argument('--dst-password', nargs='?', required=False, help='dst password, for MongoDB')
         parser.add_argument('--start-optime', type=int, nargs='?', required=False, help='timestamp in second, indicates oplog based increment sync')
         parser.add_argument('--optime-logfile', nargs='?', required=False, help="optime log file path, use this as start optime if without '--start-optime'")
+        parser.add_argument('--manifest-file', nargs='?', required=False, help='initial sync manifest file path, resume the unfinished initial sync recorded in it')
         parser.add_argument('--logfile', nargs='?', required=False, help='log file path')
 
         args = parser.parse_args()
@@ -57,6 +58,8 @@ class CommandOptions(object):
             if args.start_optime is None:
                 optime_logger = OptimeLogger(args.optime_logfile)
                 conf.start_optime = optime_logger.read()
+        if args.manifest_file is not None:
+            conf.manifest_filepath = args.manifest_file
         if args.logfile is not None:
             conf.logfilepath = args.logfile
 
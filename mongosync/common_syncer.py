@@ -2,12 +2,16 @@ import sys
 import time
 import datetime
 import builtins
+import multiprocessing
 import gevent
+from mongosync import partitioner
+from mongosync.coll_stats import CollStatsCache
 from mongosync.config import Config
 from mongosync.logger import Logger
 from mongosync.mongo_utils import get_optime
 from mongosync.optime_logger import OptimeLogger
-from mongosync.progress_logger import LoggerThread
+from mongosync.sync_manifest import SyncManifest
+from mongosync.progress_logger import ProgressCounters, ProgressReporter
 
 log = Logger.get()
 
@@ -46,19 +50,30 @@ class CommonSyncer(object):
             self._optime_logger = OptimeLogger(conf.optime_logfilepath)
         else:
             self._optime_logger = None
+        if conf.manifest_filepath:
+            self._manifest = SyncManifest(conf.manifest_filepath)
+        else:
+            self._manifest = None
         self._optime_log_interval = 10  # default 10s
         self._last_optime = None  # optime of the last oplog was applied
         self._last_optime_logtime = time.time()
 
         self._log_interval = 2  # default 2s
+        self._progress_interval = 10  # default 10s, progress of initial sync
         self._last_logtime = time.time()  # use in oplog replay
 
         # for large collections
-        self._n_workers = 8  # multi-process
-        self._large_coll_docs = 1000000  # 100w
+        self._n_workers = max(2, multiprocessing.cpu_count())  # multi-process, one per core
+        self._dst_shards = 1  # spread chunks over shards of destination
+
+        # metadata of collections, fetched once in initial sync planning
+        self._coll_stats = CollStatsCache()
+        self._planning_concurrency = 16
 
         self._initial_sync_start_optime = None
+        self._resume_initial_sync = False
         self._initial_sync_end_optime = None
+        self._snapshot_consistent = False  # initial sync read all data at the snapshot of start optime
 
         self._stage = Stage.stopped
         self._oplog_batchsize = 1000
@@ -103,75 +118,93 @@ class CommonSyncer(object):
         else:
             # initial sync
             log.info('step into stage: initial_sync')
-            self._initial_sync_start_optime = get_optime(self._src.client())
+            self._resume_initial_sync = self._manifest and self._manifest.resumable and self._oplog_available(self._manifest.start_optime)
+            if self._resume_initial_sync:
+                self._initial_sync_start_optime = self._manifest.start_optime
+                log.info("resume initial sync from manifest '%s', start optime is %s" % (self._manifest.filepath, self._initial_sync_start_optime))
+            else:
+                self._initial_sync_start_optime = get_optime(self._src.client())
             self._stage = Stage.initial_sync
             self._initial_sync()
+            if self._manifest:
+                self._manifest.finish()
 
-            # markup post initial sync
-            log.info('step into stage: post_initial_sync')
-            self._stage = Stage.post_initial_sync
-            self._initial_sync_end_optime = get_optime(self._src.client())
+            if self._snapshot_consistent:
+                # no change since start optime was copied, so no need to catch up with duplicate key error tolerated
+                log.info('initial sync is consistent at %s, step into stage: oplog_sync' % self._initial_sync_start_optime)
+                self._stage = Stage.oplog_sync
+            else:
+                # markup post initial sync
+                log.info('step into stage: post_initial_sync')
+                self._stage = Stage.post_initial_sync
+                self._initial_sync_end_optime = get_optime(self._src.client())
 
             # oplog sync
             if self._optime_logger:
                 self._optime_logger.write(self._initial_sync_start_optime)
             self._replay_oplog(self._initial_sync_start_optime)
 
+    def _oplog_available(self, optime):
+        """ Check if oplog of the optime is still available in source.
+        """
+        doc = self._src.client()['local']['oplog.rs'].find_one(sort=[('$natural', 1)])
+        if not doc or doc['ts'] > optime:
+            log.warn('oplog of %s is stale, initial sync need to start over' % optime)
+            return False
+        return True
+
     def _collect_colls(self):
         """ Collect collections to sync.
+
+        Collections of databases are listed concurrently.
         """
-        colls = []
-        for dbname in self._src.client().database_names():
-            if dbname in self._ignore_dbs:
-                continue
-            if not self._conf.data_filter.valid_db(dbname):
-                continue
+        def list_colls(dbname):
+            colls = []
             for collname in self._src.client()[dbname].collection_names(include_system_collections=False):
                 if collname in self._ignore_colls:
                     continue
                 if not self._conf.data_filter.valid_coll(dbname, collname):
                     continue
                 colls.append((dbname, collname))
+            return colls
+
+        dbnames = []
+        for dbname in self._src.client().database_names():
+            if dbname in self._ignore_dbs:
+                continue
+            if not self._conf.data_filter.valid_db(dbname):
+                continue
+            dbnames.append(dbname)
+
+        colls = []
+        pool = gevent.pool.Pool(self._planning_concurrency)
+        for res in pool.imap(list_colls, dbnames):
+            colls.extend(res)
         return colls
 
     def _split_coll(self, namespace_tuple, n_partitions):
         """ Split a collection into n partitions.
 
         Return a list of split points.
-
-        splitPointCount = partitionCount - 1
-        splitPointCount = keyTotalCount / (keyCount + 1)
-        keyCount = maxChunkSize / (2 * avgObjSize)
-        =>
-        maxChunkSize = (keyTotalCount / (partionCount - 1) - 1) * 2 * avgObjSize
-
-        Note: maxChunkObjects is default 250000.
+        Partitioners are tried in order of preference, see also mongosync.partitioner.
         """
         if n_partitions <= 1:
             raise RuntimeError('n_partitions need greater than 1, but %s' % n_partitions)
 
         dbname, collname = namespace_tuple
         ns = '.'.join(namespace_tuple)
-        db = self._src.client()[dbname]
-        collstats = db.command('collstats', collname)
-
-        if 'avgObjSize' not in collstats:  # empty collection
-            return []
-
-        n_points = n_partitions - 1
-        max_chunk_size = ((collstats['count'] / (n_partitions - 1) - 1) * 2 * collstats['avgObjSize']) / 1024 / 1024
-
-        max_chunk_size = max(1, min(max_chunk_size, 1024))
+        stats = self._coll_stats.get(namespace_tuple)
 
-        if max_chunk_size <= 0:
+        if stats.empty:
             return []
 
-        res = db.command('splitVector', ns, keyPattern={'_id': 1}, maxSplitPoints=n_points, maxChunkSize=max_chunk_size, maxChunkObjects=collstats['count'])
-
-        if res['ok'] != 1:
-            return []
+        coll = self._src.client()[dbname][collname]
+        name, points = partitioner.split_coll(coll, n_partitions, stats.collstats, self._conf.partitioner)
+        if points:
+            log.info('split %s into %d partitions with %s' % (ns, len(points) + 1, name))
         else:
-            return [doc['_id'] for doc in res['splitKeys']]
+            log.warn('split %s failed, sync it in a single process' % ns)
+        return points
 
     def _initial_sync(self):
         """ Initial sync.
@@ -179,8 +212,9 @@ class CommonSyncer(object):
         def classify(ns_tuple, large_colls, small_colls):
             """ Find out large and small collections.
             """
-            if self._is_large_collection(ns_tuple):
-                points = self._split_coll(ns_tuple, self._n_workers)
+            n_partitions = self._plan_partitions(ns_tuple)
+            if n_partitions > 1:
+                points = self._split_coll(ns_tuple, n_partitions)
                 if points:
                     large_colls.append((ns_tuple, points))
                 else:
@@ -188,47 +222,79 @@ class CommonSyncer(object):
             else:
                 small_colls.append(ns_tuple)
 
-        large_colls = []
-        small_colls = []
+        if self._resume_initial_sync:
+            # reuse classification and split points
+            large_colls, small_colls = self._manifest.plan()
+            large_colls = [(ns, points) for ns, points in large_colls if not self._manifest.coll_done('.'.join(ns))]
+            small_colls = [ns for ns in small_colls if not self._manifest.coll_done('.'.join(ns))]
+            self._coll_stats.load(self._src.client(), [ns for ns, points in large_colls] + small_colls, self._planning_concurrency)
+        else:
+            large_colls = []
+            small_colls = []
 
-        pool = gevent.pool.Pool(8)
-        colls = self._collect_colls()
-        for ns in colls:
-            dbname, collname = ns
-            log.info('%d\t%s.%s' % (self._src.client()[dbname][collname].count(), dbname, collname))
-            pool.spawn(classify, ns, large_colls, small_colls)
-        pool.join()
+            colls = self._collect_colls()
+            self._coll_stats.load(self._src.client(), colls, self._planning_concurrency)
+
+            pool = gevent.pool.Pool(8)
+            for ns in colls:
+                log.info('%d\t%s.%s' % (self._coll_stats.get(ns).count, ns[0], ns[1]))
+                pool.spawn(classify, ns, large_colls, small_colls)
+            pool.join()
 
-        if len(large_colls) + len(small_colls) != len(colls):
-            raise RuntimeError('classify collections error')
+            if len(large_colls) + len(small_colls) != len(colls):
+                raise RuntimeError('classify collections error')
+
+            if self._manifest:
+                self._manifest.reset(self._initial_sync_start_optime, large_colls, small_colls)
+
+        # largest first, so that the last ones to finish are short
+        large_colls.sort(key=lambda item: self._coll_stats.get(item[0]).size, reverse=True)
+        small_colls.sort(key=lambda ns: self._coll_stats.get(ns).size, reverse=True)
 
         log.info('large collections: %s' % ['.'.join(ns) for ns, points in large_colls])
         log.info('small collections: %s' % ['.'.join(ns) for ns in small_colls])
 
-        # create progress logger
-        self._progress_logger = LoggerThread(len(colls))
+        # create progress counters before worker processes are forked
+        self._progress = ProgressCounters([('.'.join(ns), len(points) + 1) for ns, points in large_colls] +
+                                          [('.'.join(ns), 1) for ns in small_colls])
+        self._progress_logger = ProgressReporter(self._progress, len(large_colls) + len(small_colls), self._progress_interval)
         self._progress_logger.start()
 
         # small collections first
         pool = gevent.pool.Pool(8)
-        for res in pool.imap(self._sync_collection, small_colls):
+        for ns, res in zip(small_colls, pool.imap(self._sync_collection, small_colls)):
             if res is not None:
                 sys.exit(1)
+            if self._manifest:
+                # cheap to copy again, so not worth a rewrite of the manifest for each
+                self._manifest.set_coll_done('.'.join(ns), force=False)
+        if self._manifest:
+            self._manifest.flush()
 
         # then large collections
         for ns, points in large_colls:
             self._sync_large_collection(ns, points)
+            if self._manifest:
+                self._manifest.set_coll_done('.'.join(ns))
+
+        self._progress_logger.report()
+        self._progress_logger.stop()
 
     def _sync_collection(self, namespace_tuple):
         """ Sync a collection until success.
         """
         raise NotImplementedError('you should implement %s.%s' % (self.__class__.__name__, self._sync_collection.__name__))
 
-    def _is_large_collection(self, namespace_tuple):
-        """ Check if large collection or not.
+    def _plan_partitions(self, namespace_tuple):
+        """ Return partition count of a collection, a large collection has more than one partition.
         """
-        dbname, collname = namespace_tuple
-        return self._src.client()[dbname][collname].count() > self._large_coll_docs
+        stats = self._coll_stats.get(namespace_tuple)
+        return partitioner.plan_partitions(stats.count,
+                                           stats.size,
+                                           self._n_workers,
+                                           self._dst_shards,
+                                           self._conf.target_chunk_bytes,
+                                           self._conf.target_chunk_secs)
 
     def _sync_large_collection(self, namespace_tuple):
         """ Sync large collection until success.
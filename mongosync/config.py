@@ -3,7 +3,7 @@ import logging
 import pymongo
 import io
 from pymongo import MongoClient
-from mongosync.mongo_utils import get_version
+from mongosync.mongo_utils import get_version, get_compressors, check_compressor
 from mongosync.data_filter import DataFilter
 
 
@@ -23,6 +23,15 @@ class MongoConfig(object):
         self.username = username
         self.password = password
 
+        # wire compression in order of preference, e.g. ['zstd', 'snappy', 'zlib']
+        # unsupported ones are dropped when connecting, see also mongo_utils.get_compressors
+        self.compressors = []
+        self.zlib_compression_level = None
+
+        # cursor batch size of initial sync and oplog tailing, 0 means default of server
+        self.scan_batch_size = 0
+        self.tail_batch_size = 0
+
 
 class EsConfig(object):
     def __init__(self, hosts):
@@ -44,8 +53,33 @@ class Config(object):
         # fields {'ns' : frozenset(['field0', 'field1'])}
         self.fieldmap = {}
 
+        # insert documents into empty collections or ranges in initial sync, otherwise upsert
+        self.bulk_insert = True
+
+        # copy documents in raw BSON without decoding in initial sync
+        self.raw_copy = True
+
+        # size and copy time that a chunk of large collections aims at, see also partitioner.plan_partitions
+        self.target_chunk_bytes = 256 * 1024 * 1024  # 256MB
+        self.target_chunk_secs = 300
+
+        # read all collections at the snapshot of start optime in initial sync, requires MongoDB 5.0+
+        self.snapshot_read = False
+
+        # partitioner of large collections, 'auto' or name of a partitioner
+        self.partitioner = 'auto'
+
+        # limits of reading source in initial sync, shared by all processes, 0 means no limit
+        self.max_read_docs_per_sec = 0
+        self.max_read_bytes_per_sec = 0
+
+        # lower the limits above if source is overloaded, 0 means not to check
+        self.throttle_max_queue = 0  # operations queued for locks
+        self.throttle_max_lag = 0  # replication lag of secondaries in seconds
+
         self.start_optime = None
         self.optime_logfilepath = ''
+        self.manifest_filepath = ''
         self.logfilepath = ''
 
     @property
@@ -85,16 +119,29 @@ class Config(object):
         """
         if isinstance(logger, logging.Logger):
             f = logger.info
+            warn = logger.warning
         elif isinstance(logger, io.TextIOWrapper):
             f = lambda s: logger.write('%s\n' % s)
+            warn = lambda s: logger.write('WARNING %s\n' % s)
         else:
             raise Exception('error logger')
 
+        def compressors_info(name, conf):
+            """ Output effective compressors and why the others are dropped.
+            """
+            f('%s compressors :  %s' % (name, ', '.join(get_compressors(conf.compressors)) or 'none'))
+            for compressor in conf.compressors:
+                reason = check_compressor(compressor)
+                if reason:
+                    warn('%s compressor %s is dropped: %s' % (name, compressor, reason))
+
         f('================================================')
         f('src hostportstr :  %s' % self.src_hostportstr)
         f('src authdb      :  %s' % self.src_conf.authdb)
         f('src username    :  %s' % self.src_conf.username)
         f('src password    :  %s' % self.src_conf.password)
+        compressors_info('src', self.src_conf)
+        f('src batch size  :  scan %d, tail %d' % (self.src_conf.scan_batch_size, self.src_conf.tail_batch_size))
         if isinstance(self.src_conf.hosts, str) or isinstance(self.src_conf.hosts, str):
             f('src db version  :  %s' % get_version(self.src_conf.hosts))
 
@@ -104,6 +151,7 @@ class Config(object):
                 f('dst authdb      :  %s' % self.dst_conf.authdb)
                 f('dst username    :  %s' % self.dst_conf.username)
                 f('dst password    :  %s' % self.dst_conf.password)
+                compressors_info('dst', self.dst_conf)
                 f('dst db version  :  %s' % get_version(self.dst_conf.hosts))
 
         f('databases       :  %s' % ', '.join(self.data_filter._related_dbs))
@@ -111,8 +159,16 @@ class Config(object):
         f('db mapping      :  %s' % self.dbmap_str)
         f('fileds          :  %s' % self.fieldmap_str)
 
+        f('bulk insert     :  %s' % self.bulk_insert)
+        f('raw copy        :  %s' % self.raw_copy)
+        f('snapshot read   :  %s' % self.snapshot_read)
+        f('partitioner     :  %s' % self.partitioner)
+        f('target chunk    :  %d MB, %ds' % (self.target_chunk_bytes // 1024 // 1024, self.target_chunk_secs))
+        f('read limit      :  %s docs/s, %.1f MB/s (0 means no limit)' % (self.max_read_docs_per_sec, float(self.max_read_bytes_per_sec) / 1024 / 1024))
+        f('throttle        :  max queue %d, max lag %ds (0 means not to check)' % (self.throttle_max_queue, self.throttle_max_lag))
         f('start optime    :  %s' % self.start_optime)
         f('optime logfile  :  %s' % self.optime_logfilepath)
+        f('manifest file   :  %s' % self.manifest_filepath)
         f('log filepath    :  %s' % self.logfilepath)
         f('pymongo version :  %s' % pymongo.version)
         f('================================================')
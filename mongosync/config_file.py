@@ -1,10 +1,26 @@
 import toml
 from bson.timestamp import Timestamp
 from mongosync.config import Config, MongoConfig, EsConfig
-from mongosync.mongo_utils import gen_namespace
+from mongosync.mongo_utils import gen_namespace, check_compressor
+from mongosync.partitioner import partitioners
 
 
 class ConfigFile(object):
+    @staticmethod
+    def load_transport(mongo_conf, section):
+        """ Load network transport settings of a MongoDB link.
+        """
+        if 'compressors' in section:
+            mongo_conf.compressors = list(section['compressors'])
+            for compressor in mongo_conf.compressors:
+                check_compressor(compressor)  # raise if invalid
+        if 'zlib_compression_level' in section:
+            mongo_conf.zlib_compression_level = int(section['zlib_compression_level'])
+        if 'scan_batch_size' in section:
+            mongo_conf.scan_batch_size = int(section['scan_batch_size'])
+        if 'tail_batch_size' in section:
+            mongo_conf.tail_batch_size = int(section['tail_batch_size'])
+
     @staticmethod
     def load(filepath):
         """ Load config file and generate conf.
@@ -15,12 +31,14 @@ class ConfigFile(object):
                                     tml['src'].get('authdb', 'admin'),
                                     tml['src'].get('username', ''),
                                     tml['src'].get('password', ''))
+        ConfigFile.load_transport(conf.src_conf, tml['src'])
 
         if type not in tml['dst'] or tml['dst']['type'] == 'mongo':
             conf.dst_conf = MongoConfig(tml['dst']['hosts'],
                                         tml['dst'].get('authdb', 'admin'),
                                         tml['dst'].get('username', ''),
                                         tml['dst'].get('password', ''))
+            ConfigFile.load_transport(conf.dst_conf, tml['dst'])
         elif tml['dst']['type'] == 'es':
             conf.dst_conf = EsConfig(tml['dst']['hosts'])
         else:
@@ -71,6 +89,38 @@ class ConfigFile(object):
                     # update coll filter
                     conf.data_filter.add_include_coll(gen_namespace(dbname, '*'))
 
+        if 'sync' in tml and 'bulk_insert' in tml['sync']:
+            conf.bulk_insert = bool(tml['sync']['bulk_insert'])
+
+        if 'sync' in tml and 'raw_copy' in tml['sync']:
+            conf.raw_copy = bool(tml['sync']['raw_copy'])
+
+        if 'sync' in tml and 'target_chunk_mb' in tml['sync']:
+            conf.target_chunk_bytes = int(tml['sync']['target_chunk_mb']) * 1024 * 1024
+
+        if 'sync' in tml and 'target_chunk_secs' in tml['sync']:
+            conf.target_chunk_secs = int(tml['sync']['target_chunk_secs'])
+
+        if 'sync' in tml and 'snapshot_read' in tml['sync']:
+            conf.snapshot_read = bool(tml['sync']['snapshot_read'])
+
+        if 'sync' in tml and 'partitioner' in tml['sync']:
+            conf.partitioner = tml['sync']['partitioner']
+            if conf.partitioner != 'auto' and conf.partitioner not in [p.name for p in partitioners]:
+                raise Exception('invalid sync.partitioner: %s' % conf.partitioner)
+
+        if 'sync' in tml and 'max_read_docs_per_sec' in tml['sync']:
+            conf.max_read_docs_per_sec = int(tml['sync']['max_read_docs_per_sec'])
+
+        if 'sync' in tml and 'max_read_mb_per_sec' in tml['sync']:
+            conf.max_read_bytes_per_sec = int(float(tml['sync']['max_read_mb_per_sec']) * 1024 * 1024)
+
+        if 'sync' in tml and 'throttle_max_queue' in tml['sync']:
+            conf.throttle_max_queue = int(tml['sync']['throttle_max_queue'])
+
+        if 'sync' in tml and 'throttle_max_lag' in tml['sync']:
+            conf.throttle_max_lag = int(tml['sync']['throttle_max_lag'])
+
         if 'sync' in tml and 'start_optime' in tml['sync']:
             conf.start_optime = Timestamp(tml['sync']['start_optime'], 0)
 
@@ -0,0 +1,220 @@
+import time
+import gevent
+import gevent.event
+import gevent.queue
+from mongosync.logger import Logger
+
+log = Logger.get()
+
+
+class Batch(object):
+    """ A batch of documents.
+    """
+    def __init__(self, seq):
+        self.seq = seq
+        self.docs = []
+        self.nbytes = 0
+
+
+class BatchQueue(object):
+    """ Queue of batches bounded by bytes.
+
+    A batch is always accepted by an empty queue even if it exceeds the bound.
+    """
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._nbytes = 0
+        self._q = gevent.queue.Queue()
+        self._not_full = gevent.event.Event()
+        self._not_full.set()
+
+    def put(self, batch):
+        while self._nbytes > 0 and self._nbytes + batch.nbytes > self._max_bytes:
+            self._not_full.clear()
+            self._not_full.wait()
+        self._nbytes += batch.nbytes
+        self._q.put(batch)
+
+    def get(self):
+        batch = self._q.get()
+        if batch is not None:
+            self._nbytes -= batch.nbytes
+            self._not_full.set()
+        return batch
+
+    def close(self, n_getters):
+        """ Wake up getters with None.
+        """
+        for i in range(n_getters):
+            self._q.put(None)
+
+
+class StageStats(object):
+    """ Throughput of a pipeline stage.
+
+    busy is the time spent on reading or writing, wait is the time blocked by the other stage.
+    """
+    def __init__(self, name, n_workers=1):
+        self.name = name
+        self.n_workers = n_workers
+        self.docs = 0
+        self.nbytes = 0
+        self.busy = 0.0
+        self.wait = 0.0
+
+    def __str__(self):
+        # busy time of workers is accumulated, so divide it to get throughput of the stage
+        secs = self.busy / self.n_workers
+        return '%s x%d: %d docs, %.1f MB, %.0f docs/s, %.2f MB/s, wait %.1fs' % (
+            self.name,
+            self.n_workers,
+            self.docs,
+            float(self.nbytes) / 1024 / 1024,
+            self.docs / secs if secs > 0 else 0,
+            float(self.nbytes) / 1024 / 1024 / secs if secs > 0 else 0,
+            self.wait / self.n_workers)
+
+
+class CopyPipeline(object):
+    """ Copy documents with a reader and n writers.
+
+    The reader fills a queue bounded by bytes with batches, which closes on either count or bytes,
+    and writers drain the queue continuously.
+
+    Parameters:
+      - write: function to write a list of documents
+      - sizeof: function to return bytes of a document
+      - n_writers: count of writer coroutines
+      - batch_docs: maximum document count of a batch
+      - batch_bytes: maximum bytes of a batch
+      - queue_bytes: maximum bytes of batches in queue
+      - throttle: function to wait before reading on, with document count and bytes of a batch read
+    """
+    def __init__(self, write, sizeof, n_writers=10, batch_docs=1000, batch_bytes=4*1024*1024, queue_bytes=64*1024*1024,
+                 throttle=None):
+        assert n_writers > 0
+        self._write = write
+        self._sizeof = sizeof
+        self._n_writers = n_writers
+        self._batch_docs = batch_docs
+        self._batch_bytes = batch_bytes
+        self._queue = BatchQueue(queue_bytes)
+        self._throttle = throttle
+        self.throttled = 0.0  # seconds the reader waited for throttle
+        self.read_stats = StageStats('read')
+        self.write_stats = StageStats('write', n_writers)
+
+        # for checkpoint
+        self._acked = {}  # seq => batch, written but not contiguous
+        self._next_seq = 0  # the first batch not written
+
+    def run(self, cursor, on_written=None):
+        """ Copy documents from cursor.
+
+        on_written(batch) is called in order of batches, once all batches before it are written.
+        Exception raised in any stage, e.g. AutoReconnect by cursor, is raised here.
+        """
+        self._on_written = on_written
+        greenlets = [gevent.spawn(self._read, cursor)]
+        greenlets.extend([gevent.spawn(self._drain) for i in range(self._n_writers)])
+        try:
+            gevent.joinall(greenlets, raise_error=True)
+        finally:
+            gevent.killall(greenlets)
+
+    def _read(self, cursor):
+        seq = 0
+        batch = Batch(seq)
+        start_time = time.time()
+        for doc in cursor:
+            batch.docs.append(doc)
+            batch.nbytes += self._sizeof(doc)
+            if len(batch.docs) >= self._batch_docs or batch.nbytes >= self._batch_bytes:
+                self._put(batch, start_time)
+                seq += 1
+                batch = Batch(seq)
+                start_time = time.time()
+        if batch.docs:
+            self._put(batch, start_time)
+        self._queue.close(self._n_writers)
+
+    def _put(self, batch, start_time):
+        t = time.time()
+        self.read_stats.busy += t - start_time
+        if self._throttle:
+            self.throttled += self._throttle(len(batch.docs), batch.nbytes)
+            t = time.time()
+        self._queue.put(batch)
+        self.read_stats.wait += time.time() - t
+        self.read_stats.docs += len(batch.docs)
+        self.read_stats.nbytes += batch.nbytes
+
+    def _drain(self):
+        while True:
+            t = time.time()
+            batch = self._queue.get()
+            self.write_stats.wait += time.time() - t
+            if batch is None:
+                return
+            t = time.time()
+            self._write(batch.docs)
+            self.write_stats.busy += time.time() - t
+            self.write_stats.docs += len(batch.docs)
+            self.write_stats.nbytes += batch.nbytes
+            self._ack(batch)
+
+    def _ack(self, batch):
+        self._acked[batch.seq] = batch
+        while self._next_seq in self._acked:
+            batch = self._acked.pop(self._next_seq)
+            self._next_seq += 1
+            if self._on_written:
+                self._on_written(batch)
+
+    def bottleneck(self):
+        """ Return the stage that limits throughput.
+        """
+        if self.write_stats.wait / self._n_writers > self.read_stats.wait:
+            return self.read_stats.name
+        else:
+            return self.write_stats.name
+
+
+if __name__ == '__main__':
+    written = []
+    checkpoints = []
+
+    def write(docs):
+        # the later batch is written first
+        gevent.sleep(0.01 if docs[0] % 20 == 0 else 0)
+        written.extend(docs)
+
+    pipeline = CopyPipeline(write, lambda doc: 100, n_writers=4, batch_docs=10, batch_bytes=500, queue_bytes=2000)
+    pipeline.run(iter(range(100)), on_written=lambda batch: checkpoints.append(batch.docs[-1]))
+    assert sorted(written) == list(range(100))
+    assert checkpoints == list(range(4, 100, 5))
+    assert pipeline.read_stats.docs == pipeline.write_stats.docs == 100
+    assert pipeline.read_stats.nbytes == pipeline.write_stats.nbytes == 10000
+
+    def fail(docs):
+        raise RuntimeError('write failed')
+
+    pipeline = CopyPipeline(fail, lambda doc: 1)
+    try:
+        pipeline.run(iter(range(100)))
+        assert False
+    except RuntimeError:
+        pass
+
+    throttled = []
+
+    def throttle(n_docs, n_bytes):
+        throttled.append((n_docs, n_bytes))
+        return 0.5
+
+    pipeline = CopyPipeline(lambda docs: None, lambda doc: 10, batch_docs=30, throttle=throttle)
+    pipeline.run(iter(range(100)))
+    assert throttled == [(30, 300), (30, 300), (30, 300), (10, 100)]
+    assert pipeline.throttled == 2.0
+
+    print('test cases all pass')
@@ -47,6 +47,8 @@ class DataFilter(object):
         elif op == 'c':
             dbname, _ = parse_namespace(ns)
             return dbname in self._related_dbs
+        elif op == 'i' and ns.endswith('.system.indexes'):
+            return self.valid_ns(oplog['o']['ns'])
         else:
             return self.valid_ns(ns)
 
@@ -92,4 +94,9 @@ if __name__ == '__main__':
     assert f.valid_oplog(oplog8)
     assert f.valid_oplog(oplog9) is False
 
+    oplog10 = {'op': 'i', 'ns': 'db1.system.indexes', 'o': {'ns': 'db1.coll'}}
+    oplog11 = {'op': 'i', 'ns': 'db1.system.indexes', 'o': {'ns': 'db1.collx'}}
+    assert f.valid_oplog(oplog10)
+    assert f.valid_oplog(oplog11) is False
+
     print('test cases all pass')
@@ -1,4 +1,6 @@
+import struct
 import collections
+import bson
 
 
 def doc_flat_to_nested(key_list, val):
@@ -60,6 +62,46 @@ def merge_doc(doc1, doc2):
     return doc1
 
 
+# fixed value size of BSON types
+_bson_value_sizes = {
+    b'\x01': 8,   # double
+    b'\x07': 12,  # ObjectId
+    b'\x08': 1,   # boolean
+    b'\x09': 8,   # UTC datetime
+    b'\x0a': 0,   # null
+    b'\x10': 4,   # int32
+    b'\x11': 8,   # timestamp
+    b'\x12': 8,   # int64
+    b'\x13': 16,  # decimal128
+    b'\x7f': 0,   # max key
+    b'\xff': 0,   # min key
+}
+
+
+def get_raw_id(raw_doc):
+    """ Get _id of a RawBSONDocument without decoding other fields.
+
+    _id is generally the first field, otherwise decode the document.
+    """
+    raw = raw_doc.raw
+    elem_type = raw[4:5]
+    if raw[5:9] != b'_id\x00':
+        return raw_doc['_id']
+    pos = 9
+    if elem_type in _bson_value_sizes:
+        size = _bson_value_sizes[elem_type]
+    elif elem_type == b'\x02':  # string
+        size = 4 + struct.unpack('<i', raw[pos:pos+4])[0]
+    elif elem_type == b'\x03' or elem_type == b'\x04':  # document or array
+        size = struct.unpack('<i', raw[pos:pos+4])[0]
+    elif elem_type == b'\x05':  # binary
+        size = 5 + struct.unpack('<i', raw[pos:pos+4])[0]
+    else:
+        return raw_doc['_id']
+    elem = raw[4:pos+size]
+    return bson.BSON(struct.pack('<i', len(elem) + 5) + elem + b'\x00').decode()['_id']
+
+
 if __name__ == '__main__':
     doc = {'a': {'b': {'c': 1, 'd': 2}}}
     doc1 = {'a': {'b': {'c': 1}}}
@@ -74,4 +116,11 @@ if __name__ == '__main__':
     assert gen_doc_with_fields(doc, ['a.b.c']) == doc1
     assert gen_doc_with_fields(doc, ['a.b.d']) == doc2
 
+    from bson.raw_bson import RawBSONDocument
+    for _id in [bson.ObjectId(), 1, 2**40, 1.5, 'abc', {'a': 1}, [1, 2], bson.Binary(b'xyz'), None, True]:
+        raw_doc = RawBSONDocument(bson.BSON.encode(bson.son.SON([('_id', _id), ('x', 'y')])))
+        assert get_raw_id(raw_doc) == bson.BSON(raw_doc.raw).decode()['_id']
+    raw_doc = RawBSONDocument(bson.BSON.encode(bson.son.SON([('x', 'y'), ('_id', 1)])))
+    assert get_raw_id(raw_doc) == 1
+
     print('test cases all pass')
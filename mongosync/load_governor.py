@@ -0,0 +1,184 @@
+import time
+import multiprocessing
+import pymongo
+from mongosync.logger import Logger
+
+log = Logger.get()
+
+
+class TokenBucket(object):
+    """ Token bucket in shared memory.
+
+    It's shared by processes forked after it's created, e.g. the worker processes of large collections.
+    Tokens may go negative, so that a request larger than the burst proceeds after paying off the debt.
+    """
+    def __init__(self, rate, burst=None):
+        assert rate > 0
+        self._rate = float(rate)
+        self._burst = float(burst if burst else rate)
+        self._state = multiprocessing.RawArray('d', [self._burst, time.time()])  # tokens, last refill time
+        self._lock = multiprocessing.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def consume(self, n, factor=1.0):
+        """ Take n tokens with the rate scaled by factor, return seconds to wait before proceeding.
+        """
+        rate = self._rate * factor
+        with self._lock:
+            now = time.time()
+            tokens = min(self._burst, self._state[0] + (now - self._state[1]) * rate)
+            tokens -= n
+            self._state[0] = tokens
+            self._state[1] = now
+        return -tokens / rate if tokens < 0 else 0.0
+
+
+class LoadGovernor(object):
+    """ Limit reads from source in documents/sec and bytes/sec, shared by all copy processes.
+
+    The limits are scaled by a shared factor in [min_factor, 1.0], which is halved once the source is overloaded
+    and recovers step by step otherwise.
+    """
+    def __init__(self, max_docs_per_sec=0, max_bytes_per_sec=0, min_factor=0.1, recover_step=0.1):
+        self._docs_bucket = TokenBucket(max_docs_per_sec) if max_docs_per_sec > 0 else None
+        self._bytes_bucket = TokenBucket(max_bytes_per_sec) if max_bytes_per_sec > 0 else None
+        self._factor = multiprocessing.RawValue('d', 1.0)
+        self._min_factor = min_factor
+        self._recover_step = recover_step
+
+    @property
+    def enabled(self):
+        return self._docs_bucket is not None or self._bytes_bucket is not None
+
+    @property
+    def factor(self):
+        return self._factor.value
+
+    def throttle(self, n_docs, n_bytes):
+        """ Wait until n_docs documents of n_bytes are allowed to read, return seconds waited.
+        """
+        wait = 0.0
+        factor = self._factor.value
+        if self._docs_bucket:
+            wait = max(wait, self._docs_bucket.consume(n_docs, factor))
+        if self._bytes_bucket:
+            wait = max(wait, self._bytes_bucket.consume(n_bytes, factor))
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def adjust(self, overloaded):
+        """ Decrease limits multiplicatively if overloaded, otherwise increase them additively.
+        Return the new factor.
+        """
+        if overloaded:
+            self._factor.value = max(self._min_factor, self._factor.value / 2)
+        else:
+            self._factor.value = min(1.0, self._factor.value + self._recover_step)
+        return self._factor.value
+
+
+class SourceHealth(object):
+    """ Health signals of source replica set.
+
+    The source is overloaded if operations queued for locks exceed max_queue,
+    or any secondary lags behind primary more than max_lag seconds.
+    A signal is disabled if it's 0 or the command is not permitted.
+    """
+    def __init__(self, mongo_handler, max_queue=0, max_lag=0):
+        self._mongo_handler = mongo_handler
+        self._max_queue = max_queue
+        self._max_lag = max_lag
+
+    @property
+    def enabled(self):
+        return self._max_queue > 0 or self._max_lag > 0
+
+    def check(self):
+        """ Return a reason if the source is overloaded, otherwise None.
+        """
+        if self._max_queue > 0:
+            queue = self._get_queue()
+            if queue is not None and queue > self._max_queue:
+                return '%d operations queued' % queue
+        if self._max_lag > 0:
+            lag = self._get_lag()
+            if lag is not None and lag > self._max_lag:
+                return 'secondary lags %ds' % lag
+        return None
+
+    def _get_queue(self):
+        try:
+            status = self._mongo_handler.client().admin.command('serverStatus')
+            return status['globalLock']['currentQueue']['total']
+        except pymongo.errors.OperationFailure as e:
+            log.warn('queue length of source is unavailable: %s' % e)
+            self._max_queue = 0
+            return None
+
+    def _get_lag(self):
+        try:
+            status = self._mongo_handler.client().admin.command('replSetGetStatus')
+        except pymongo.errors.OperationFailure as e:
+            log.warn('replication lag of source is unavailable: %s' % e)
+            self._max_lag = 0
+            return None
+        return get_max_lag(status['members'])
+
+
+def get_max_lag(members):
+    """ Return maximum replication lag of secondaries in seconds from the members of replSetGetStatus.
+    """
+    primary = [m for m in members if m.get('stateStr') == 'PRIMARY']
+    secondaries = [m for m in members if m.get('stateStr') == 'SECONDARY']
+    if not primary or not secondaries:
+        return 0
+    return max([(primary[0]['optimeDate'] - m['optimeDate']).total_seconds() for m in secondaries])
+
+
+if __name__ == '__main__':
+    import datetime
+
+    bucket = TokenBucket(100)
+    assert bucket.consume(100) == 0.0
+    wait = bucket.consume(50)
+    assert 0.4 < wait <= 0.5
+    # debt is paid off at halved rate
+    wait = bucket.consume(50, 0.5)
+    assert 1.9 < wait <= 2.0
+
+    governor = LoadGovernor()
+    assert not governor.enabled
+    assert governor.throttle(1000, 1000000) == 0.0
+
+    governor = LoadGovernor(max_docs_per_sec=1000, max_bytes_per_sec=1000)
+    assert governor.enabled
+    assert governor.throttle(10, 1000) == 0.0
+    assert governor.adjust(True) == 0.5
+    assert governor.adjust(True) == 0.25
+    assert governor.adjust(True) == 0.125
+    assert governor.adjust(True) == 0.1
+    assert abs(governor.adjust(False) - 0.2) < 1e-9
+    for i in range(10):
+        governor.adjust(False)
+    assert governor.factor == 1.0
+
+    # shared by forked processes
+    governor = LoadGovernor(max_docs_per_sec=10)
+    p = multiprocessing.Process(target=governor.adjust, args=(True,))
+    p.start()
+    p.join()
+    assert governor.factor == 0.5
+
+    now = datetime.datetime(2020, 1, 1, 0, 0, 10)
+    members = [{'stateStr': 'PRIMARY', 'optimeDate': now},
+               {'stateStr': 'SECONDARY', 'optimeDate': now - datetime.timedelta(seconds=3)},
+               {'stateStr': 'SECONDARY', 'optimeDate': now - datetime.timedelta(seconds=7)},
+               {'stateStr': 'ARBITER'}]
+    assert get_max_lag(members) == 7
+    assert get_max_lag(members[:1]) == 0
+
+    print('test cases all pass')
@@ -15,6 +15,8 @@ class MongoHandler(object):
             raise Exception('expect MongoConfig')
         self._conf = conf
         self._mc = None
+        # turned off once user has no privilege of bypassDocumentValidation, e.g. role readWrite
+        self._bypass_document_validation = True
 
     def __del__(self):
         self.close()
@@ -28,7 +30,9 @@ class MongoHandler(object):
                 self._mc = mongo_utils.connect(host, port,
                                                authdb=self._conf.authdb,
                                                username=self._conf.username,
-                                               password=self._conf.password)
+                                               password=self._conf.password,
+                                               compressors=self._conf.compressors,
+                                               zlib_compression_level=self._conf.zlib_compression_level)
                 self._mc.admin.command('ismaster')
                 return True
             elif isinstance(self._conf.__hosts, list):
@@ -72,7 +76,68 @@ class MongoHandler(object):
                 log.error('%s' % e)
                 self.reconnect()
 
-    def bulk_write(self, dbname, collname, reqs, ordered=True, ignore_duplicate_key_error=False):
+    def create_indexes(self, dbname, collname, specs):
+        """ Create indexes with one command.
+
+        The command fails as a whole if any index fails, then create them one by one,
+        so that only the indexes that actually fail are missing.
+        """
+        if not self._create_indexes(dbname, collname, specs) and len(specs) > 1:
+            for spec in specs:
+                self._create_indexes(dbname, collname, [spec])
+
+    def _create_indexes(self, dbname, collname, specs):
+        """ Run command 'createIndexes', return False if failed.
+        """
+        cmd = bson.son.SON([('createIndexes', collname), ('indexes', specs)])
+        while True:
+            try:
+                self._mc[dbname].command(cmd)
+                return True
+            except pymongo.errors.AutoReconnect as e:
+                log.error('%s' % e)
+                self.reconnect()
+            except pymongo.errors.OperationFailure as e:
+                # e.g. an index with the same name but different options already existed
+                if len(specs) > 1:
+                    log.warn('create %d indexes on %s.%s failed, create them one by one: %s' % (len(specs), dbname, collname, e))
+                else:
+                    log.error('create index on %s.%s failed: %s: %s' % (dbname, collname, e, specs[0]))
+                return False
+
+    def insert_docs(self, dbname, collname, docs, get_id=None):
+        """ Insert documents in an unordered bulk and bypass document validation if permitted.
+
+        Documents that failed to insert, generally duplicate key error of a retried range, are upserted instead.
+        get_id(doc) returns _id for upserts, e.g. doc_utils.get_raw_id to avoid decoding a RawBSONDocument.
+        """
+        while True:
+            try:
+                self._mc[dbname][collname].insert_many(docs, ordered=False, bypass_document_validation=self._bypass_document_validation)
+                return
+            except pymongo.errors.AutoReconnect as e:
+                log.error('%s' % e)
+                self.reconnect()
+            except pymongo.errors.BulkWriteError as e:
+                write_errors = e.details.get('writeErrors', [])
+                n_dups = len([err for err in write_errors if err.get('code') in (11000, 11001)])
+                log.info('insert %d documents into %s.%s, %d duplicate key errors, %d other errors, upsert them' % (
+                    len(docs), dbname, collname, n_dups, len(write_errors) - n_dups))
+                failed_docs = [docs[err['index']] for err in write_errors]
+                break
+            except pymongo.errors.OperationFailure as e:
+                if e.code != 13 or not self._bypass_document_validation:  # 13: Unauthorized
+                    raise
+                log.warn('not authorized to bypass document validation, insert with validation from now on: %s' % e)
+                self._bypass_document_validation = False
+
+        if get_id is None:
+            get_id = lambda doc: doc['_id']
+        reqs = [pymongo.ReplaceOne({'_id': get_id(doc)}, doc, upsert=True) for doc in failed_docs]
+        self.bulk_write(dbname, collname, reqs, ordered=False, ignore_duplicate_key_error=True,
+                        bypass_document_validation=self._bypass_document_validation)
+
+    def bulk_write(self, dbname, collname, reqs, ordered=True, ignore_duplicate_key_error=False, bypass_document_validation=False):
         """ Bulk write until success.
         """
         
@@ -90,7 +155,7 @@ class MongoHandler(object):
             try:
                 self._mc[dbname][collname].bulk_write(reqs,
                                                       ordered=ordered,
-                                                      bypass_document_validation=False)
+                                                      bypass_document_validation=bypass_document_validation)
                 return
             except pymongo.errors.AutoReconnect as e:
                 log.error('%s' % e)
@@ -102,11 +167,14 @@ class MongoHandler(object):
                     while True:
                         try:
                             if isinstance(req, pymongo.ReplaceOne):
-                                self._mc[dbname][collname].replace_one(req._filter, req._doc, upsert=req._upsert)
+                                self._mc[dbname][collname].replace_one(req._filter, req._doc, upsert=req._upsert,
+                                                                       bypass_document_validation=bypass_document_validation)
                             elif isinstance(req, pymongo.InsertOne):
-                                self._mc[dbname][collname].insert_one(req._doc)
+                                self._mc[dbname][collname].insert_one(req._doc,
+                                                                      bypass_document_validation=bypass_document_validation)
                             elif isinstance(req, pymongo.UpdateOne):
-                                self._mc[dbname][collname].update_one(req._filter, req._doc, upsert=req._upsert)
+                                self._mc[dbname][collname].update_one(req._filter, req._doc, upsert=req._upsert,
+                                                                      bypass_document_validation=bypass_document_validation)
                             elif isinstance(req, pymongo.DeleteOne):
                                 self._mc[dbname][collname].delete_one(req._filter)
                             else:
@@ -139,6 +207,8 @@ class MongoHandler(object):
         cursor = coll.find({'fromMigrate': {'$exists': False}, 'ts': {'$gte': start_optime}},
                            cursor_type=pymongo.cursor.CursorType.TAILABLE_AWAIT,
                            no_cursor_timeout=True)
+        if self._conf.tail_batch_size > 0:
+            cursor.batch_size(self._conf.tail_batch_size)
         # New in version 3.2
         # src_version = mongo_utils.get_version(self._mc)
         # if mongo_utils.version_higher_or_equal(src_version, '3.2.0'):
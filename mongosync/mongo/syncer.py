@@ -1,16 +1,33 @@
+import sys
 import time
-import multiprocessing
+import contextlib
 import gevent
 import pymongo
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from mongosync import mongo_utils
 from mongosync.logger import Logger
 from mongosync.config import MongoConfig
 from mongosync.common_syncer import CommonSyncer, Stage
+from mongosync.copy_pipeline import CopyPipeline
+from mongosync.doc_utils import get_raw_id
+from mongosync.load_governor import LoadGovernor, SourceHealth
 from mongosync.mongo.handler import MongoHandler
+from mongosync.mongo.index_builder import IndexBuilder, gen_index_spec
 from mongosync.multi_oplog_replayer import MultiOplogReplayer
+from mongosync.network_stats import NetworkStatsLogger
+from mongosync.partitioner import gen_range_queries, chunk_balance
+from mongosync.worker_pool import WorkerPool, TaskError
 
 log = Logger.get()
 
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+# error codes of snapshot reads that are no longer possible at the cluster time
+SNAPSHOT_ERROR_CODES = [239,  # SnapshotTooOld
+                        246]  # SnapshotUnavailable
+
 
 class MongoSyncer(CommonSyncer):
     """ MongoDB synchronizer.
@@ -29,51 +46,189 @@ class MongoSyncer(CommonSyncer):
         if not self._dst.connect():
             raise RuntimeError('connect to mongodb(dst) failed: %s' % self._conf.dst_hostportstr)
         self._multi_oplog_replayer = MultiOplogReplayer(self._dst, 10)
+        self._dst_shards = mongo_utils.get_shard_count(self._dst.client())
 
-    def _create_index(self, namespace_tuple):
-        """ Create indexes.
+        self._worker_pool = None  # for large collections, started on demand
+        self._index_builder = IndexBuilder(self._dst, 4)
+
+        # copy pipeline of initial sync
+        self._codec_options = CodecOptions(document_class=bson.son.SON)
+        self._copy_writers = 10
+        self._copy_batch_docs = 1000
+        self._copy_batch_bytes = 4 * 1024 * 1024  # 4MB
+        self._copy_queue_bytes = 64 * 1024 * 1024  # 64MB
+
+        # throttle reads from source, created before worker processes are forked to share limits
+        self._governor = LoadGovernor(self._conf.max_read_docs_per_sec, self._conf.max_read_bytes_per_sec)
+        self._source_health = SourceHealth(self._src, self._conf.throttle_max_queue, self._conf.throttle_max_lag)
+        self._health_check_interval = 5  # default 5s
+
+        # cluster time of snapshot reads in initial sync, None if not to read at a snapshot
+        self._snapshot_optime = None
+
+        # network traffic of both sides, logged by stage
+        self._network_stats = [NetworkStatsLogger('src', self._src), NetworkStatsLogger('dst', self._dst)]
+        self._network_stats_interval = 600  # default 10min in oplog sync
+        self._last_network_stats_time = time.time()
+
+    def _initial_sync(self):
+        """ Initial sync.
         """
-        def format(key_direction_list):
-            """ Format key and direction of index.
-            """
-            res = []
-            for key, direction in key_direction_list:
-                if isinstance(direction, float) or isinstance(direction, int):
-                    direction = int(direction)
-                res.append((key, direction))
-            return res
+        for stats in self._network_stats:
+            stats.sample()
+        if self._conf.snapshot_read and self._resume_initial_sync:
+            # chunks synced before might not be read at the snapshot
+            log.warn('snapshot read is disabled when resuming initial sync')
+        elif self._conf.snapshot_read:
+            version = mongo_utils.get_version(self._src.client())
+            if mongo_utils.version_higher_or_equal(version.split('-')[0], '5.0.0'):
+                self._snapshot_optime = self._initial_sync_start_optime
+                log.info('read at snapshot %s in initial sync' % self._snapshot_optime)
+            else:
+                log.warn('snapshot read requires MongoDB 5.0 or later, but source is %s' % version)
+        governor = None
+        if self._governor.enabled and self._source_health.enabled:
+            governor = gevent.spawn(self._govern)
+        try:
+            CommonSyncer._initial_sync(self)
+        finally:
+            if governor:
+                governor.kill()
+        if self._worker_pool:
+            self._worker_pool.stop()
+            self._worker_pool = None
+        self._snapshot_consistent = self._snapshot_optime is not None
+        self._log_network_stats('initial_sync', force=True)
+
+    def _govern(self):
+        """ Adjust read limits by health of source periodically.
+        """
+        while True:
+            gevent.sleep(self._health_check_interval)
+            try:
+                reason = self._source_health.check()
+            except pymongo.errors.PyMongoError as e:
+                log.warn('check health of source failed: %s' % e)
+                continue
+            factor = self._governor.factor
+            if self._governor.adjust(reason is not None) != factor:
+                if reason:
+                    log.warn('source is overloaded (%s), lower read limits to %d%%' % (reason, self._governor.factor * 100))
+                else:
+                    log.info('raise read limits to %d%%' % (self._governor.factor * 100))
+
+    def _log_network_stats(self, stage, force=False):
+        """ Log network traffic since the last time, periodically unless forced.
+        """
+        now = time.time()
+        if force or now - self._last_network_stats_time >= self._network_stats_interval:
+            for stats in self._network_stats:
+                stats.log(stage)
+            self._last_network_stats_time = now
 
+    def _create_index(self, namespace_tuple):
+        """ Create indexes with one command.
+        """
         dbname, collname = namespace_tuple
         dst_dbname, dst_collname = self._conf.db_coll_mapping(dbname, collname)
         index_info = self._src.client()[dbname][collname].index_information()
-        for name, info in list(index_info.items()):
-            keys = info['key']
-            options = {}
-            options['name'] = name
-            if 'unique' in info:
-                options['unique'] = info['unique']
-            if 'sparse' in info:
-                options['sparse'] = info['sparse']
-            if 'expireAfterSeconds' in info:
-                options['expireAfterSeconds'] = info['expireAfterSeconds']
-            if 'partialFilterExpression' in info:
-                options['partialFilterExpression'] = info['partialFilterExpression']
-            if 'dropDups' in info:
-                options['dropDups'] = info['dropDups']
-
-            ## create indexes before import documents, so not need 'background' option
-            # if 'background' in info:
-            #     options['background'] = info['background']
-
-            # for text index
-            if 'weights' in info:
-                options['weights'] = info['weights']
-            if 'default_language' in info:
-                options['default_language'] = info['default_language']
-            if 'language_override' in info:
-                options['language_override'] = info['language_override']
-
-            self._dst.create_index(dst_dbname, dst_collname, format(keys), **options)
+        specs = [gen_index_spec(name, info) for name, info in list(index_info.items()) if name != '_id_']
+        self._index_builder.build(dst_dbname, dst_collname, specs)
+
+    def _push_index_oplog(self, oplog):
+        """ Push an index oplog, consecutive index oplogs are built in batch.
+        """
+        dbname, _ = mongo_utils.parse_namespace(oplog['ns'])
+        if oplog['op'] == 'c':
+            collname = oplog['o']['createIndexes']
+        else:
+            # insert into system.indexes, namespace of the index is not mapped yet
+            src_dbname, src_collname = mongo_utils.parse_namespace(oplog['o']['ns'])
+            dbname, collname = self._conf.db_coll_mapping(src_dbname, src_collname)
+        self._index_builder.push(dbname, collname, gen_index_spec(oplog['o']['name'], oplog['o']), oplog['ts'])
+
+    @contextlib.contextmanager
+    def _find(self, namespace_tuple, query=None, sort=False):
+        """ Yield a cursor of raw documents for initial sync, and close it once done.
+
+        Read at the snapshot of start optime if enabled, see also mongo_utils.snapshot_find.
+        """
+        dbname, collname = namespace_tuple
+        coll = self._src.client()[dbname].get_collection(collname, codec_options=RAW_CODEC_OPTIONS)
+        if self._snapshot_optime is not None:
+            with mongo_utils.snapshot_find(coll,
+                                           self._snapshot_optime,
+                                           query,
+                                           sort=[('_id', pymongo.ASCENDING)] if sort else None,
+                                           batch_size=self._conf.src_conf.scan_batch_size) as cursor:
+                yield cursor
+            return
+
+        if sort:
+            cursor = coll.find(filter=query,
+                               sort=[('_id', pymongo.ASCENDING)],
+                               cursor_type=pymongo.cursor.CursorType.EXHAUST,
+                               no_cursor_timeout=True,
+                               batch_size=self._conf.src_conf.scan_batch_size
+                               # snapshot cause blocking, maybe bug
+                               # modifiers={'$snapshot': True}
+                               )
+        else:
+            cursor = coll.find(filter=query,
+                               cursor_type=pymongo.cursor.CursorType.EXHAUST,
+                               no_cursor_timeout=True,
+                               modifiers={'$snapshot': True},
+                               batch_size=self._conf.src_conf.scan_batch_size)
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def _lose_snapshot(self, ns, e):
+        """ Fall back to read without snapshot, oplogs need to be replayed since start optime as usual.
+        """
+        log.warn('snapshot %s is lost when syncing %s, read without snapshot: %s' % (self._snapshot_optime, ns, e))
+        self._snapshot_optime = None
+
+    def _is_empty_range(self, dbname, collname, query=None):
+        """ Check if there is no document in the range of destination collection.
+        """
+        return self._dst.client()[dbname][collname].find_one(query, {'_id': 1}) is None
+
+    def _write_docs(self, dbname, collname, docs, insert=False):
+        """ Write documents in initial sync.
+
+        Documents are read as RawBSONDocument and written as they are in raw copy mode,
+        only _id is decoded for upserts. Otherwise decode them before writing.
+        Insert into an empty range, otherwise upsert.
+        """
+        if not self._conf.raw_copy:
+            docs = [bson.BSON(doc.raw).decode(codec_options=self._codec_options) for doc in docs]
+        if insert:
+            self._dst.insert_docs(dbname, collname, docs, get_raw_id if self._conf.raw_copy else None)
+        else:
+            reqs = [pymongo.ReplaceOne({'_id': get_raw_id(doc) if self._conf.raw_copy else doc['_id']}, doc, upsert=True) for doc in docs]
+            self._dst.bulk_write(dbname, collname, reqs, ordered=False, ignore_duplicate_key_error=True)
+
+    def _copy_docs(self, src_ns, cursor, dst_dbname, dst_collname, insert, on_written):
+        """ Copy documents from cursor with a reader/writer pipeline.
+
+        on_written(batch) is called in order of batches once they are written.
+        """
+        pipeline = CopyPipeline(lambda docs: self._write_docs(dst_dbname, dst_collname, docs, insert),
+                                lambda doc: len(doc.raw),
+                                n_writers=self._copy_writers,
+                                batch_docs=self._copy_batch_docs,
+                                batch_bytes=self._copy_batch_bytes,
+                                queue_bytes=self._copy_queue_bytes,
+                                throttle=self._governor.throttle if self._governor.enabled else None)
+        try:
+            pipeline.run(cursor, on_written)
+        finally:
+            if pipeline.throttled > 0:
+                log.info('%s: %s | %s | throttled %.1fs' % (src_ns, pipeline.read_stats, pipeline.write_stats, pipeline.throttled))
+            else:
+                log.info('%s: %s | %s | bound by %s' % (src_ns, pipeline.read_stats, pipeline.write_stats, pipeline.bottleneck()))
 
     def _sync_collection(self, namespace_tuple):
         """ Sync a collection until success.
@@ -85,47 +240,31 @@ class MongoSyncer(CommonSyncer):
         dst_dbname, dst_collname = self._conf.db_coll_mapping(src_dbname, src_collname)
         src_ns = '%s.%s' % (src_dbname, src_collname)
 
-        total = self._src.client()[src_dbname][src_collname].count()
-        self._progress_logger.register(src_ns, total)
+        self._progress_logger.register(src_ns, self._coll_stats.get(namespace_tuple).count)
 
         while True:
             try:
-                cursor = self._src.client()[src_dbname][src_collname].find(filter=None,
-                                                                           cursor_type=pymongo.cursor.CursorType.EXHAUST,
-                                                                           no_cursor_timeout=True,
-                                                                           modifiers={'$snapshot': True})
-
-                reqs = []
-                reqs_max = 100
-                groups = []
-                groups_max = 10
-                n = 0
-
-                for doc in cursor:
-                    reqs.append(pymongo.ReplaceOne({'_id': doc['_id']}, doc, upsert=True))
-                    if len(reqs) == reqs_max:
-                        groups.append(reqs)
-                        reqs = []
-                    if len(groups) == groups_max:
-                        threads = [gevent.spawn(self._dst.bulk_write, dst_dbname, dst_collname, groups[i], ordered=False, ignore_duplicate_key_error=True) for i in range(groups_max)]
-                        gevent.joinall(threads, raise_error=True)
-                        groups = []
-
-                    n += 1
-                    if n % 10000 == 0:
-                        self._progress_logger.add(src_ns, n)
-                        n = 0
-
-                if len(groups) > 0:
-                    threads = [gevent.spawn(self._dst.bulk_write, dst_dbname, dst_collname, groups[i], ordered=False, ignore_duplicate_key_error=True) for i in range(len(groups))]
-                    gevent.joinall(threads, raise_error=True)
-                if len(reqs) > 0:
-                    self._dst.bulk_write(dst_dbname, dst_collname, reqs, ordered=False, ignore_duplicate_key_error=True)
-
-                self._progress_logger.add(src_ns, n, done=True)
+                # copy from the beginning again after retry
+                self._progress.reset(src_ns, 0)
+
+                insert = self._conf.bulk_insert and self._is_empty_range(dst_dbname, dst_collname)
+                if insert:
+                    log.info('%s is empty in destination, insert documents' % src_ns)
+
+                def on_written(batch):
+                    self._progress.add(src_ns, 0, len(batch.docs), batch.nbytes)
+
+                with self._find(namespace_tuple) as cursor:
+                    self._copy_docs(src_ns, cursor, dst_dbname, dst_collname, insert, on_written)
+
+                self._progress_logger.done(src_ns)
                 return
             except pymongo.errors.AutoReconnect:
                 self._src.reconnect()
+            except pymongo.errors.OperationFailure as e:
+                if self._snapshot_optime is None or e.code not in SNAPSHOT_ERROR_CODES:
+                    raise
+                self._lose_snapshot(src_ns, e)
 
     def _sync_large_collection(self, namespace_tuple, split_points):
         """ Sync large collection.
@@ -133,108 +272,119 @@ class MongoSyncer(CommonSyncer):
         # create indexes first
         self._create_index(namespace_tuple)
 
-        dbname, collname = namespace_tuple
         ns = '.'.join(namespace_tuple)
 
-        log.info('pending to sync %s with %d processes' % (ns, len(split_points) + 1))
-
-        coll = self._src.client()[dbname][collname]
-        total = coll.count()
-        self._progress_logger.register(ns, total)
-
-        prog_q = multiprocessing.Queue()
-        res_q = multiprocessing.Queue()
-
-        proc_logging = multiprocessing.Process(target=logging_progress, args=(ns, total, prog_q))
-        proc_logging.start()
-
-        queries = []
-        lower_bound = None
-        for point in split_points:
-            if lower_bound is None:
-                queries.append({'_id': {'$lt': point}})
-            else:
-                queries.append({'_id': {'$gte': lower_bound, '$lt': point}})
-            lower_bound = point
-        queries.append({'_id': {'$gte': lower_bound}})
-
-        procs = []
-        for query in queries:
-            p = multiprocessing.Process(target=self._sync_collection_with_query, args=(namespace_tuple, query, prog_q, res_q))
-            p.start()
-            procs.append(p)
-            log.info('start process %s with query %s' % (p.name, query))
-
-        for p in procs:
-            p.join()
-
-        n_docs = 0
-        for p in procs:
-            n_docs += res_q.get()
-        self._progress_logger.add(ns, n_docs, done=True)
-
-        prog_q.put(True)
-        prog_q.close()
-        prog_q.join_thread()
-        proc_logging.join()
-
-    def _sync_collection_with_query(self, namespace_tuple, query, prog_q, res_q):
-        """ Sync collection with query.
+        log.info('pending to sync %s with %d chunks' % (ns, len(split_points) + 1))
+
+        self._progress_logger.register(ns, self._coll_stats.get(namespace_tuple).count)
+
+        if not self._worker_pool:
+            self._worker_pool = WorkerPool(self._n_workers, self._init_worker, self._run_chunk)
+            self._worker_pool.start()
+
+        queries = gen_range_queries(split_points)
+
+        n_tasks = 0
+        base_counts = [0] * len(queries)
+        counts = [0] * len(queries)
+        for i, query in enumerate(queries):
+            last_id = None
+            if self._resume_initial_sync:
+                chunk = self._manifest.chunk(ns, i)
+                base_counts[i] = counts[i] = chunk['count']
+                self._progress.add(ns, i, chunk['count'])
+                if chunk['done']:
+                    log.info('skip chunk %d of %s, it has been synced' % (i, ns))
+                    continue
+                last_id = chunk['last_id']
+            self._worker_pool.submit((namespace_tuple, i, query, last_id))
+            n_tasks += 1
+            log.info('submit chunk %d of %s with query %s, resume after %s' % (i, ns, query, last_id))
+
+        # aggregate checkpoints until all chunks done
+        while n_tasks > 0:
+            m = self._worker_pool.get()
+            if isinstance(m, TaskError):
+                if m.task is None:
+                    log.error('sync %s failed: %s' % (ns, m.error))
+                else:
+                    log.error('sync chunk %d of %s failed: %s' % (m.task[1], ns, m.error))
+                sys.exit(1)
+            if m[0] == 'snapshot_lost':
+                self._snapshot_optime = None
+            elif m[0] == 'checkpoint':
+                i, last_id, count, done = m[1:]
+                counts[i] = base_counts[i] + count
+                if self._manifest:
+                    self._manifest.update_chunk(ns, i, last_id, counts[i], done)
+                if done:
+                    n_tasks -= 1
+
+        self._progress_logger.done(ns)
+
+        n_min, n_avg, n_max, skew = chunk_balance(counts)
+        log.info('chunk balance of %s: %d chunks, min/avg/max %d/%d/%d docs, skew %.2f' % (ns, len(counts), n_min, n_avg, n_max, skew))
+
+    def _init_worker(self):
+        """ Initialize a worker process of the pool.
         """
         self._src.reconnect()
         self._dst.reconnect()
 
+    def _run_chunk(self, task, report):
+        """ Run a chunk task in a worker process.
+        """
+        namespace_tuple, index, query, last_id = task
+        self._sync_collection_with_query(namespace_tuple, index, query, last_id, report)
+
+    def _sync_collection_with_query(self, namespace_tuple, index, query, last_id, report):
+        """ Sync collection with query.
+
+        Documents are copied in _id order and resume after last_id if specified.
+        Progress is counted in shared memory.
+        Report checkpoints in tuple ('checkpoint', index, last_id, count, done),
+        and ('snapshot_lost',) if the snapshot to read at is no longer available.
+        """
         src_dbname, src_collname = namespace_tuple
         dst_dbname, dst_collname = self._conf.db_coll_mapping(src_dbname, src_collname)
+        ns = '%s.%s' % namespace_tuple
 
+        n_written = 0
         while True:
             try:
-                cursor = self._src.client()[src_dbname][src_collname].find(filter=query,
-                                                                           cursor_type=pymongo.cursor.CursorType.EXHAUST,
-                                                                           no_cursor_timeout=True,
-                                                                           # snapshot cause blocking, maybe bug
-                                                                           # modifiers={'$snapshot': True}
-                                                                           )
-                total = 0
-                n = 0
-                reqs = []
-                reqs_max = 100
-                groups = []
-                groups_max = 10
-
-                for doc in cursor:
-                    reqs.append(pymongo.ReplaceOne({'_id': doc['_id']}, doc, upsert=True))
-                    if len(reqs) == reqs_max:
-                        groups.append(reqs)
-                        reqs = []
-                    if len(groups) == groups_max:
-                        threads = [gevent.spawn(self._dst.bulk_write, dst_dbname, dst_collname, groups[i], ordered=False, ignore_duplicate_key_error=True) for i in range(groups_max)]
-                        gevent.joinall(threads, raise_error=True)
-                        groups = []
-
-                    n += 1
-                    total += 1
-                    if n % 10000 == 0:
-                        prog_q.put(n)
-                        n = 0
-
-                if len(groups) > 0:
-                    threads = [gevent.spawn(self._dst.bulk_write, dst_dbname, dst_collname, groups[i], ordered=False, ignore_duplicate_key_error=True) for i in range(len(groups))]
-                    gevent.joinall(threads, raise_error=True)
-                if len(reqs) > 0:
-                    self._dst.bulk_write(dst_dbname, dst_collname, reqs, ordered=False, ignore_duplicate_key_error=True)
-
-                if n > 0:
-                    prog_q.put(n)
-                res_q.put(total)
-
-                prog_q.close()
-                prog_q.join_thread()
-                res_q.close()
-                res_q.join_thread()
+                if last_id is None:
+                    range_query = query
+                else:
+                    # $not also matches _id in other types than last_id
+                    range_query = {'$and': [query, {'_id': {'$not': {'$lte': last_id}}}]}
+
+                insert = self._conf.bulk_insert and self._is_empty_range(dst_dbname, dst_collname, range_query)
+
+                def on_written(batch):
+                    nonlocal n_written, last_id
+                    n_written += len(batch.docs)
+                    last_id = get_raw_id(batch.docs[-1])
+                    self._progress.add(ns, index, len(batch.docs), batch.nbytes)
+                    report(('checkpoint', index, last_id, n_written, False))
+
+                with self._find(namespace_tuple, range_query, sort=True) as cursor:
+                    self._copy_docs(ns, cursor, dst_dbname, dst_collname, insert, on_written)
+
+                report(('checkpoint', index, last_id, n_written, True))
                 return
             except pymongo.errors.AutoReconnect:
                 self._src.reconnect()
+            except pymongo.errors.OperationFailure as e:
+                if self._snapshot_optime is None or e.code not in SNAPSHOT_ERROR_CODES:
+                    raise
+                self._lose_snapshot(ns, e)
+                report(('snapshot_lost',))
+
+    def _flush_index_oplogs(self):
+        """ Build indexes of pushed index oplogs.
+        """
+        self._index_builder.flush()
+        self._last_optime = self._index_builder.last_optime()
 
     def _replay_oplog(self, start_optime):
         """ Replay oplog.
@@ -265,6 +415,7 @@ class MongoSyncer(CommonSyncer):
                     if need_log:
                         self._log_optime(self._last_optime)
                         self._log_progress()
+                        self._log_network_stats('oplog_sync' if self._stage == Stage.oplog_sync else 'post_initial_sync')
                         need_log = False
 
                     if not cursor.alive:
@@ -279,6 +430,9 @@ class MongoSyncer(CommonSyncer):
                         if oplog['ts'] == self._last_optime:
                             log.info('oplog is ok: %s' % self._last_optime)
                             start_optime_valid = True
+                            if self._snapshot_consistent:
+                                # applied already, initial sync read at the snapshot of it
+                                continue
                         else:
                             log.error('oplog %s is stale, terminate' % self._last_optime)
                             return
@@ -300,6 +454,25 @@ class MongoSyncer(CommonSyncer):
                     if dst_dbname != dbname or dst_collname != collname:
                         oplog['ns'] = '%s.%s' % (dst_dbname, dst_collname)
 
+                    if mongo_utils.is_index_oplog(oplog):
+                        # apply previous oplogs first
+                        if self._multi_oplog_replayer and self._multi_oplog_replayer.count() > 0:
+                            self._multi_oplog_replayer.apply(ignore_duplicate_key_error=self._stage == Stage.post_initial_sync)
+                            self._multi_oplog_replayer.clear()
+                            self._last_optime = self._multi_oplog_replayer.last_optime()
+                            need_log = True
+                        self._push_index_oplog(oplog)
+                        if self._stage == Stage.post_initial_sync and oplog['ts'] == self._initial_sync_end_optime:
+                            self._flush_index_oplogs()
+                            need_log = True
+                            log.info('step into stage: oplog_sync')
+                            self._stage = Stage.oplog_sync
+                        continue
+
+                    if self._index_builder.count() > 0:
+                        self._flush_index_oplogs()
+                        need_log = True
+
                     if self._stage == Stage.post_initial_sync:
                         if self._multi_oplog_replayer:
                             if mongo_utils.is_command(oplog):
@@ -348,6 +521,9 @@ class MongoSyncer(CommonSyncer):
                         self._multi_oplog_replayer.clear()
                         self._last_optime = self._multi_oplog_replayer.last_optime()
                         need_log = True
+                    if self._index_builder.count() > 0:
+                        self._flush_index_oplogs()
+                        need_log = True
                     # no more oplogs, wait a moment
                     time.sleep(0.1)
                     self._log_optime(self._last_optime)
@@ -365,17 +541,3 @@ class MongoSyncer(CommonSyncer):
                     self._src.reconnect()
                     break
 
-
-def logging_progress(ns, total, prog_q):
-    curr = 0
-    while True:
-        m = prog_q.get()
-        if isinstance(m, bool):
-            return
-        curr += m
-        s = '\t%s\t%d/%d\t[%.2f%%]' % (
-                ns,
-                curr,
-                total,
-                float(curr)/total*100 if total > 0 else float(curr+1)/(total+1)*100)
-        log.info(s)
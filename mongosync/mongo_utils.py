@@ -1,5 +1,7 @@
+import contextlib
 import pymongo
 import bson
+from pymongo.command_cursor import CommandCursor
 
 
 def gen_uri(hosts, username=None, password=None, authdb='admin'):
@@ -38,6 +40,37 @@ def gen_uri(hosts, username=None, password=None, authdb='admin'):
         return 'mongodb://%s' % parse(hosts)
 
 
+def check_compressor(compressor):
+    """ Return the reason why a compressor cannot be used, or None if it's supported.
+
+    Wire compression is supported since pymongo 3.7 (snappy and zlib) and 3.9 (zstd).
+    """
+    if compressor not in ('snappy', 'zlib', 'zstd'):
+        raise Exception('invalid compressor: %s' % compressor)
+    min_version = (3, 9) if compressor == 'zstd' else (3, 7)
+    if pymongo.version_tuple < min_version:
+        return 'requires pymongo %s or later, but pymongo is %s' % ('.'.join(map(str, min_version)), pymongo.version)
+    if compressor == 'snappy':
+        try:
+            import snappy
+        except ImportError:
+            return 'requires python-snappy'
+    elif compressor == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            return 'requires zstandard'
+    return None
+
+
+def get_compressors(compressors):
+    """ Return compressors supported by pymongo and installed libraries, keep the order of preference.
+
+    The server picks the first one it also supports.
+    """
+    return [compressor for compressor in compressors if check_compressor(compressor) is None]
+
+
 def connect(host, port, **kwargs):
     """ Connect and return a available handler.
     Recognize replica set automatically.
@@ -47,11 +80,18 @@ def connect(host, port, **kwargs):
         authdb = admin
         read_preference = PRIMARY
         w = 1
+        compressors = [], no wire compression
     """
     authdb = kwargs.get('authdb', 'admin')  # default authdb is 'admin'
     username = kwargs.get('username', '')
     password = kwargs.get('password', '')
     w = kwargs.get('w', 1)
+    options = {}
+    compressors = get_compressors(kwargs.get('compressors', []))
+    if compressors:
+        options['compressors'] = ','.join(compressors)
+        if 'zlib' in compressors and kwargs.get('zlib_compression_level') is not None:
+            options['zlibCompressionLevel'] = kwargs['zlib_compression_level']
     replset_name = get_replica_set_name(host, port, **kwargs)
     if replset_name:
         mc = pymongo.MongoClient(host=host,
@@ -61,14 +101,16 @@ def connect(host, port, **kwargs):
                                  serverSelectionTimeoutMS=3000,
                                  replicaSet=replset_name,
                                  read_preference=pymongo.read_preferences.ReadPreference.PRIMARY,
-                                 w=w)
+                                 w=w,
+                                 **options)
     else:
         mc = pymongo.MongoClient(host,
                                  port,
                                  document_class=bson.son.SON,
                                  connect=True,
                                  serverSelectionTimeoutMS=3000,
-                                 w=w)
+                                 w=w,
+                                 **options)
     if username and password and authdb:
         # raise exception if auth failed here
         mc[authdb].authenticate(username, password)
@@ -91,6 +133,53 @@ def get_version(arg):
         raise Exception('invalid argument type @%s' % get_version.__name__)
 
 
+def get_shard_count(mc):
+    """ Return shard count of a sharded cluster, or 1 if it's not connected to mongos.
+    """
+    try:
+        return max(1, len(mc.admin.command('listShards')['shards']))
+    except pymongo.errors.OperationFailure:
+        return 1
+
+
+@contextlib.contextmanager
+def snapshot_find(coll, cluster_time, query=None, sort=None, batch_size=0):
+    """ Yield a cursor of documents read at the snapshot of cluster time, it requires MongoDB 5.0 or later.
+
+    find() of pymongo 3.x has no such option, so run command 'find' and iterate its result with a command cursor.
+    The command runs in an explicit session which is also passed to the cursor,
+    since server rejects getMore that isn't in the session where the cursor was created.
+    """
+    cmd = bson.son.SON([('find', coll.name)])
+    if query:
+        cmd['filter'] = query
+    if sort:
+        cmd['sort'] = bson.son.SON(sort)
+    if batch_size > 0:
+        cmd['batchSize'] = batch_size
+    cmd['noCursorTimeout'] = True
+    cmd['readConcern'] = {'level': 'snapshot', 'atClusterTime': cluster_time}
+
+    client = coll.database.client
+    session = None
+    if pymongo.version_tuple >= (3, 6):  # no session before pymongo 3.6
+        session = client.start_session()
+    cursor = None
+    try:
+        if session:
+            res = coll.database.command(cmd, codec_options=coll.codec_options, session=session)
+            cursor = CommandCursor(coll, res['cursor'], client.address, session=session, explicit_session=True)
+        else:
+            res = coll.database.command(cmd, codec_options=coll.codec_options)
+            cursor = CommandCursor(coll, res['cursor'], client.address)
+        yield cursor
+    finally:
+        if cursor:
+            cursor.close()
+        if session:
+            session.end_session()
+
+
 def get_replica_set_name(host, port, **kwargs):
     """ Get replica set name.
     Return a empty string if it's not a replica set.
@@ -225,3 +314,90 @@ def is_command(oplog):
     if op == 'c' or (op == 'i' and '_id' not in oplog['o']):
         return True
     return False
+
+
+def is_index_oplog(oplog):
+    """ Check if oplog creates an index.
+    """
+    op = oplog['op']
+    if op == 'i' and oplog['ns'].endswith('.system.indexes'):
+        return True
+    if op == 'c' and 'createIndexes' in oplog['o']:
+        return True
+    return False
+
+
+if __name__ == '__main__':
+    from bson.codec_options import CodecOptions
+    from bson.timestamp import Timestamp
+
+    class FakeSession(object):
+        def __init__(self):
+            self.ended = False
+
+        def end_session(self):
+            self.ended = True
+
+    class FakeClient(object):
+        address = ('127.0.0.1', 27017)
+
+        def __init__(self):
+            self.sessions = []
+
+        def start_session(self):
+            self.sessions.append(FakeSession())
+            return self.sessions[-1]
+
+        def _cleanup_cursor(self, *args, **kwargs):
+            pass
+
+    class FakeDatabase(object):
+        def __init__(self, client):
+            self.client = client
+            self.commands = []
+
+        def command(self, cmd, codec_options=None, session=None):
+            self.commands.append((cmd, session))
+            return {'cursor': {'id': 0, 'ns': 'db.coll', 'firstBatch': [{'_id': 1}, {'_id': 2}]}, 'ok': 1.0}
+
+        def _fix_outgoing(self, doc, coll):
+            return doc
+
+    class FakeCollection(object):
+        name = 'coll'
+        full_name = 'db.coll'
+        codec_options = CodecOptions()
+
+        def __init__(self, database):
+            self.database = database
+
+    client = FakeClient()
+    coll = FakeCollection(FakeDatabase(client))
+    ts = Timestamp(1600000000, 1)
+    with snapshot_find(coll, ts, {'_id': {'$gte': 1}}, sort=[('_id', 1)], batch_size=100) as cursor:
+        assert [doc['_id'] for doc in cursor] == [1, 2]
+        cmd, session = coll.database.commands[0]
+        assert cmd == {'find': 'coll', 'filter': {'_id': {'$gte': 1}}, 'sort': {'_id': 1}, 'batchSize': 100,
+                       'noCursorTimeout': True, 'readConcern': {'level': 'snapshot', 'atClusterTime': ts}}
+        assert list(cmd.keys())[0] == 'find'
+        if pymongo.version_tuple >= (3, 6):
+            # getMore must run in the session of find
+            assert session is client.sessions[0]
+            assert cursor.session is session
+            assert not session.ended
+    if pymongo.version_tuple >= (3, 6):
+        assert client.sessions[0].ended
+
+    # session is ended if the command failed
+    def fail(cmd, codec_options=None, session=None):
+        raise pymongo.errors.OperationFailure('SnapshotTooOld', 239)
+    coll.database.command = fail
+    try:
+        with snapshot_find(coll, ts) as cursor:
+            assert False
+    except pymongo.errors.OperationFailure as e:
+        assert e.code == 239
+    if pymongo.version_tuple >= (3, 6):
+        assert client.sessions[1].ended
+
+    print('test cases all pass')
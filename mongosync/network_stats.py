@@ -0,0 +1,101 @@
+import pymongo
+from mongosync.logger import Logger
+
+log = Logger.get()
+
+
+def get_network_stats(mc):
+    """ Return section 'network' of serverStatus.
+    """
+    return mc.admin.command('serverStatus')['network']
+
+
+def diff_network_stats(prev, curr):
+    """ Return traffic between two samples of network stats.
+
+    Result is a dict with keys 'bytesIn', 'bytesOut' and 'compression',
+    compression maps compressor name to uncompressed and compressed bytes in both directions.
+    """
+    def delta(key, prev, curr):
+        return curr.get(key, 0) - prev.get(key, 0)
+
+    res = {'bytesIn': delta('bytesIn', prev, curr),
+           'bytesOut': delta('bytesOut', prev, curr),
+           'compression': {}}
+    for name, stats in list(curr.get('compression', {}).items()):
+        prev_stats = prev.get('compression', {}).get(name, {})
+        res['compression'][name] = {
+            # uncompressed => compressed
+            'compressor': (delta('bytesIn', prev_stats.get('compressor', {}), stats.get('compressor', {})),
+                           delta('bytesOut', prev_stats.get('compressor', {}), stats.get('compressor', {}))),
+            # compressed => uncompressed
+            'decompressor': (delta('bytesIn', prev_stats.get('decompressor', {}), stats.get('decompressor', {})),
+                             delta('bytesOut', prev_stats.get('decompressor', {}), stats.get('decompressor', {})))}
+    return res
+
+
+def _mb(n):
+    return float(n) / 1024 / 1024
+
+
+class NetworkStatsLogger(object):
+    """ Log network traffic and compression ratio of a server by stage.
+
+    Note that serverStatus counts traffic of all clients of the server.
+    """
+    def __init__(self, name, mongo_handler):
+        self._name = name
+        self._mongo_handler = mongo_handler
+        self._enabled = True
+        self._last_stats = None
+
+    def sample(self):
+        """ Sample stats as the start of a stage.
+        """
+        self._last_stats = self._get()
+
+    def log(self, stage):
+        """ Log traffic since the last sample.
+        """
+        stats = self._get()
+        if stats is None or self._last_stats is None:
+            self._last_stats = stats
+            return
+        diff = diff_network_stats(self._last_stats, stats)
+        self._last_stats = stats
+
+        s = '%s network in stage %s (server-wide): in %.1f MB, out %.1f MB' % (self._name, stage, _mb(diff['bytesIn']), _mb(diff['bytesOut']))
+        for name, compression in list(diff['compression'].items()):
+            raw_out, wire_out = compression['compressor']
+            wire_in, raw_in = compression['decompressor']
+            if raw_out == 0 and raw_in == 0:
+                continue
+            s += ', %s sent %.1f MB => %.1f MB (%.2fx), received %.1f MB => %.1f MB (%.2fx)' % (
+                name,
+                _mb(raw_out), _mb(wire_out), float(raw_out) / wire_out if wire_out else 0,
+                _mb(wire_in), _mb(raw_in), float(raw_in) / wire_in if wire_in else 0)
+        log.info(s)
+
+    def _get(self):
+        if not self._enabled:
+            return None
+        try:
+            return get_network_stats(self._mongo_handler.client())
+        except pymongo.errors.OperationFailure as e:
+            log.warn('%s network stats disabled: %s' % (self._name, e))
+            self._enabled = False
+            return None
+
+
+if __name__ == '__main__':
+    prev = {'bytesIn': 100, 'bytesOut': 1000, 'compression': {'snappy': {'compressor': {'bytesIn': 800, 'bytesOut': 400},
+                                                                        'decompressor': {'bytesIn': 10, 'bytesOut': 20}}}}
+    curr = {'bytesIn': 200, 'bytesOut': 3000, 'compression': {'snappy': {'compressor': {'bytesIn': 4800, 'bytesOut': 2400},
+                                                                        'decompressor': {'bytesIn': 60, 'bytesOut': 120}},
+                                                             'zlib': {'compressor': {'bytesIn': 10, 'bytesOut': 5}}}}
+    diff = diff_network_stats(prev, curr)
+    assert diff['bytesIn'] == 100
+    assert diff['bytesOut'] == 2000
+    assert diff['compression']['snappy'] == {'compressor': (4000, 2000), 'decompressor': (50, 100)}
+    assert diff['compression']['zlib'] == {'compressor': (10, 5), 'decompressor': (0, 0)}
+    print('test cases all pass')
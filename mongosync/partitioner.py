@@ -0,0 +1,310 @@
+import math
+import datetime
+import pymongo
+from bson.objectid import ObjectId
+from bson.int64 import Int64
+from bson.decimal128 import Decimal128
+from mongosync.logger import Logger
+
+log = Logger.get()
+
+
+def type_bracket(val):
+    """ Return the comparison bracket of a BSON value.
+
+    Query operators such as $lt and $gte only match values in the same bracket,
+    e.g. numbers of any type are compared with each other, but never with strings.
+    """
+    if isinstance(val, bool):
+        return bool
+    if isinstance(val, (int, float, Decimal128)):
+        return int
+    if isinstance(val, str):
+        return str
+    if isinstance(val, dict):
+        return dict
+    return type(val)
+
+
+def uniform_points(points):
+    """ Keep split points in the most common type bracket.
+
+    Split points must be in a single bracket, see also gen_range_queries.
+    """
+    brackets = {}
+    for point in points:
+        bracket = type_bracket(point)
+        brackets[bracket] = brackets.get(bracket, 0) + 1
+    if len(brackets) <= 1:
+        return points
+    bracket = max(list(brackets.items()), key=lambda item: item[1])[0]
+    return [point for point in points if type_bracket(point) == bracket]
+
+
+def gen_range_queries(split_points):
+    """ Generate _id range queries from split points.
+
+    The first range is negated, so that it also covers _id values of other types than split points.
+    """
+    if not split_points:
+        return [{}]
+    queries = []
+    lower_bound = None
+    for point in split_points:
+        if lower_bound is None:
+            queries.append({'_id': {'$not': {'$gte': point}}})
+        else:
+            queries.append({'_id': {'$gte': lower_bound, '$lt': point}})
+        lower_bound = point
+    queries.append({'_id': {'$gte': lower_bound}})
+    return queries
+
+
+def chunk_balance(counts):
+    """ Return min, average and max document count of chunks, and skew (max / average).
+    """
+    if not counts:
+        return 0, 0.0, 0, 1.0
+    avg = float(sum(counts)) / len(counts)
+    skew = max(counts) / avg if avg > 0 else 1.0
+    return min(counts), avg, max(counts), skew
+
+
+def plan_partitions(count, size, n_workers, n_shards=1,
+                    target_chunk_bytes=256*1024*1024, target_chunk_secs=300,
+                    docs_per_sec=20000, bytes_per_sec=32*1024*1024, max_partitions=1024):
+    """ Return partition count of a collection with count documents of size bytes.
+
+    A chunk is expected to be no larger than target_chunk_bytes, and to be copied in target_chunk_secs
+    at the estimated throughput of a worker, which costs per document and per byte.
+    A collection that needs more than one chunk is split into at least n_workers partitions to keep all workers busy,
+    and into a multiple of n_shards partitions to spread writes over shards of destination.
+    """
+    if count <= 0 or size <= 0:
+        return 1
+    secs = float(count) / docs_per_sec + float(size) / bytes_per_sec
+    n = int(max(math.ceil(float(size) / target_chunk_bytes), math.ceil(secs / target_chunk_secs)))
+    if n <= 1:
+        return 1
+    n = max(n, n_workers)
+    if n_shards > 1:
+        n = int(math.ceil(float(n) / n_shards)) * n_shards
+    return min(n, max_partitions)
+
+
+class Partitioner(object):
+    """ Split a collection into _id ranges.
+
+    Specific partitioner should implement split() and return split points in ascending order.
+    Return an empty list if the collection cannot be split with this strategy.
+    """
+    name = ''
+
+    def split(self, coll, n_partitions, collstats):
+        raise NotImplementedError('you should implement %s.%s' % (self.__class__.__name__, self.split.__name__))
+
+
+class SplitVectorPartitioner(Partitioner):
+    """ Split with command 'splitVector', it requires clusterManager or similar privileges.
+
+    splitPointCount = partitionCount - 1
+    splitPointCount = keyTotalCount / (keyCount + 1)
+    keyCount = maxChunkSize / (2 * avgObjSize)
+    =>
+    maxChunkSize = (keyTotalCount / (partionCount - 1) - 1) * 2 * avgObjSize
+
+    Note: maxChunkObjects is default 250000.
+    """
+    name = 'splitVector'
+
+    def split(self, coll, n_partitions, collstats):
+        n_points = n_partitions - 1
+        max_chunk_size = ((float(collstats['count']) / n_points - 1) * 2 * collstats['avgObjSize']) / 1024 / 1024
+        if max_chunk_size > 1024:
+            # maxChunkSize is limited to 1024MB, split points would crowd at the beginning
+            return []
+        max_chunk_size = int(max(1, max_chunk_size))
+
+        res = coll.database.command('splitVector', coll.full_name,
+                                    keyPattern={'_id': 1},
+                                    maxSplitPoints=n_points,
+                                    maxChunkSize=max_chunk_size,
+                                    maxChunkObjects=collstats['count'])
+        if res['ok'] != 1:
+            return []
+        return [doc['_id'] for doc in res['splitKeys']]
+
+
+class SamplePartitioner(Partitioner):
+    """ Split at quantiles of _id sampled by $sample, it requires MongoDB 3.2 or later.
+
+    Samples scale with partitions up to max_samples, enough for max_partitions of plan_partitions().
+    If fewer than min_samples_per_partition could be sampled, quantiles are too coarse, leave it to other partitioners.
+    """
+    name = 'sample'
+
+    def __init__(self, samples_per_partition=100, min_samples_per_partition=10, max_samples=102400):
+        self._samples_per_partition = samples_per_partition
+        self._min_samples_per_partition = min_samples_per_partition
+        self._max_samples = max_samples
+
+    def split(self, coll, n_partitions, collstats):
+        size = min(n_partitions * self._samples_per_partition, self._max_samples, collstats['count'])
+        if size < n_partitions * self._min_samples_per_partition:
+            return []
+        # sort on server, _id of different types are ordered as BSON does
+        cursor = coll.aggregate([{'$sample': {'size': size}},
+                                 {'$project': {'_id': 1}},
+                                 {'$sort': {'_id': 1}}],
+                                allowDiskUse=True)
+        ids = [doc['_id'] for doc in cursor]
+        points = []
+        for i in range(1, n_partitions):
+            point = ids[i * len(ids) // n_partitions]
+            if not points or point != points[-1]:
+                points.append(point)
+        return points
+
+
+class InterpolatePartitioner(Partitioner):
+    """ Split evenly between the min and max _id.
+
+    Support ObjectId (by generation time), numbers and datetimes.
+    Chunks are balanced only if _id is distributed evenly.
+    """
+    name = 'interpolate'
+
+    def split(self, coll, n_partitions, collstats):
+        min_id, max_id = get_id_bounds(coll)
+        if min_id is None or type_bracket(min_id) != type_bracket(max_id):
+            return []
+
+        if isinstance(min_id, ObjectId):
+            start = min_id.generation_time
+            step = (max_id.generation_time - start) / n_partitions
+            if step < datetime.timedelta(seconds=1):
+                return []
+            points = [ObjectId.from_datetime(start + step * i) for i in range(1, n_partitions)]
+        elif isinstance(min_id, datetime.datetime):
+            step = (max_id - min_id) / n_partitions
+            if step <= datetime.timedelta(0):
+                return []
+            points = [min_id + step * i for i in range(1, n_partitions)]
+        elif type_bracket(min_id) is int and isinstance(min_id, int) and isinstance(max_id, int):
+            step = (max_id - min_id) // n_partitions
+            if step < 1:
+                return []
+            points = [Int64(min_id + step * i) for i in range(1, n_partitions)]
+        elif type_bracket(min_id) is int and isinstance(min_id, (int, float)) and isinstance(max_id, (int, float)):
+            step = float(max_id - min_id) / n_partitions
+            if step <= 0:
+                return []
+            points = [min_id + step * i for i in range(1, n_partitions)]
+        else:
+            return []
+        return points
+
+
+class IndexScanPartitioner(Partitioner):
+    """ Split by walking the _id index with covered queries.
+
+    It works with any _id type and only requires the find privilege,
+    but scans all keys of the _id index once.
+    """
+    name = 'indexScan'
+
+    def split(self, coll, n_partitions, collstats):
+        step = collstats['count'] // n_partitions
+        if step < 1:
+            return []
+        points = []
+        for _ in range(1, n_partitions):
+            query = {'_id': {'$gt': points[-1]}} if points else {}
+            cursor = coll.find(query, {'_id': 1}).sort('_id', pymongo.ASCENDING).hint([('_id', pymongo.ASCENDING)]).skip(step if not points else step - 1).limit(1)
+            docs = list(cursor)
+            if not docs:
+                break
+            points.append(docs[0]['_id'])
+        return points
+
+
+def get_id_bounds(coll):
+    """ Return the min and max _id of a collection, or (None, None) if it's empty.
+    """
+    min_docs = list(coll.find({}, {'_id': 1}).sort('_id', pymongo.ASCENDING).limit(1))
+    max_docs = list(coll.find({}, {'_id': 1}).sort('_id', pymongo.DESCENDING).limit(1))
+    if not min_docs or not max_docs:
+        return None, None
+    return min_docs[0]['_id'], max_docs[0]['_id']
+
+
+# ordered by preference
+partitioners = [SplitVectorPartitioner(), SamplePartitioner(), InterpolatePartitioner(), IndexScanPartitioner()]
+
+
+def split_coll(coll, n_partitions, collstats, strategy='auto'):
+    """ Split a collection with the first partitioner that works.
+
+    Return name of the partitioner and split points.
+    """
+    for partitioner in partitioners:
+        if strategy != 'auto' and strategy != partitioner.name:
+            continue
+        try:
+            points = uniform_points(partitioner.split(coll, n_partitions, collstats))
+        except pymongo.errors.OperationFailure as e:
+            log.warn('%s: partitioner %s failed: %s' % (coll.full_name, partitioner.name, e))
+            continue
+        if points:
+            return partitioner.name, points
+        log.info('%s: partitioner %s found no split points' % (coll.full_name, partitioner.name))
+    return '', []
+
+
+if __name__ == '__main__':
+    assert type_bracket(1) == type_bracket(Int64(1)) == type_bracket(1.5)
+    assert type_bracket(True) != type_bracket(1)
+    assert type_bracket('a') != type_bracket(ObjectId())
+
+    assert uniform_points([1, 2, 3]) == [1, 2, 3]
+    assert uniform_points([1, 'a', 2, 3]) == [1, 2, 3]
+
+    assert gen_range_queries([]) == [{}]
+    assert gen_range_queries([10, 20]) == [{'_id': {'$not': {'$gte': 10}}},
+                                           {'_id': {'$gte': 10, '$lt': 20}},
+                                           {'_id': {'$gte': 20}}]
+
+    MB = 1024 * 1024
+    assert plan_partitions(0, 0, 8) == 1
+    assert plan_partitions(1000, MB, 8) == 1
+    # 1.1M documents of 100 bytes, copied in a minute
+    assert plan_partitions(1100000, 110 * MB, 8) == 1
+    # 1GB of 1KB documents, more chunks by size than workers
+    assert plan_partitions(1000000, 1024 * MB, 2) == 4
+    assert plan_partitions(1000000, 1024 * MB, 8) == 8
+    assert plan_partitions(1000000, 1024 * MB, 8, n_shards=3) == 9
+    # 100M tiny documents take long, split by time
+    assert plan_partitions(100000000, 2000 * MB, 8) == 17
+    # 2 billion documents of 1KB
+    assert plan_partitions(2000000000, 2000000000 * 1024, 8) == 1024
+
+    class FakeSampleColl(object):
+        def __init__(self):
+            self.size = None
+
+        def aggregate(self, pipeline, **kwargs):
+            self.size = pipeline[0]['$sample']['size']
+            return [{'_id': i} for i in range(self.size)]
+
+    coll = FakeSampleColl()
+    points = SamplePartitioner().split(coll, 1024, {'count': 2000000000})
+    assert coll.size == 102400
+    assert len(points) == 1023 and points[0] == 100
+    coll = FakeSampleColl()
+    assert SamplePartitioner(max_samples=5000).split(coll, 1024, {'count': 2000000000}) == []
+    assert coll.size is None
+
+    assert chunk_balance([]) == (0, 0.0, 0, 1.0)
+    assert chunk_balance([10, 30]) == (10, 20.0, 30, 1.5)
+
+    print('test cases all pass')
@@ -2,19 +2,48 @@ import sys
 import time
 import multiprocessing
 import threading
-import queue
 from mongosync.logger import Logger
 
 log = Logger.get()
 
 
-class Message(object):
-    """ Progress change message.
+class ProgressCounters(object):
+    """ Counters of documents and bytes copied, one per chunk, in shared memory.
+
+    Create it before worker processes are forked.
+    A chunk is copied by a single process at a time, so its counters are updated without lock or IPC,
+    and readers may see them a bit stale.
     """
-    def __init__(self, ns, cnt, done):
-        self.ns = ns
-        self.cnt = cnt
-        self.done = done
+    def __init__(self, chunks):
+        """ chunks is a list of (ns, chunk count).
+        """
+        self._slots = {}  # (ns, index) => slot
+        self._ns_slots = {}  # ns => [slot]
+        for ns, n_chunks in chunks:
+            self._ns_slots[ns] = []
+            for i in range(n_chunks):
+                self._slots[(ns, i)] = len(self._slots)
+                self._ns_slots[ns].append(self._slots[(ns, i)])
+        self._docs = multiprocessing.RawArray('q', len(self._slots))
+        self._bytes = multiprocessing.RawArray('q', len(self._slots))
+
+    def add(self, ns, index, n_docs, n_bytes=0):
+        slot = self._slots[(ns, index)]
+        self._docs[slot] += n_docs
+        self._bytes[slot] += n_bytes
+
+    def reset(self, ns, index):
+        """ Reset counters of a chunk which is copied again from the beginning.
+        """
+        slot = self._slots[(ns, index)]
+        self._docs[slot] = 0
+        self._bytes[slot] = 0
+
+    def get(self, ns):
+        """ Return documents and bytes copied of a collection.
+        """
+        slots = self._ns_slots[ns]
+        return sum([self._docs[slot] for slot in slots]), sum([self._bytes[slot] for slot in slots])
 
 
 class Progress(object):
@@ -22,112 +51,42 @@ class Progress(object):
     """
     def __init__(self, ns, total):
         self.ns = ns
-        self.curr = 0
         self.total = total
         self.start_time = time.time()
-        self.done = False
+        self.docs = 0  # last sampled
+        self.nbytes = 0
 
 
-class LoggerThread(threading.Thread):
-    """ Logger thread.
-    """
-    def __init__(self, n_colls, **kwargs):
-        self._n_colls = n_colls
-        self._q = queue.Queue()
-        self._ns_map = {}
-        super(LoggerThread, self).__init__(**kwargs)
+def _eta(n_left, rate):
+    if rate <= 0:
+        return '-'
+    secs = int(n_left / rate)
+    return '%d:%02d:%02d' % (secs // 3600, secs % 3600 // 60, secs % 60)
 
-    def run(self):
-        n_colls_done = 0
-        while n_colls_done < self._n_colls:
-            m = self._q.get()
-            if m.ns not in self._ns_map:
-                raise Exception('missing namespace: %s' % m.ns)
-            self._ns_map[m.ns].curr += m.cnt
-            prog = self._ns_map[m.ns]
-            s = '\t%s\t%d/%d\t[%.2f%%]' % (
-                    prog.ns,
-                    prog.curr,
-                    prog.total,
-                    float(prog.curr)/prog.total*100 if prog.total > 0 else float(prog.curr+1)/(prog.total+1)*100)
-
-            if not m.done:
-                log.info(s)
-            else:
-                log.info('[ OK ] ' + s)
-                n_colls_done += 1
-                time_used = time.time() - prog.start_time
-                sys.stdout.write('\r\33[K')
-                sys.stdout.write('\r[\033[32m OK \033[0m]\t[%d/%d]\t%s\t%d/%d\t%.1fs\n' % (n_colls_done, self._n_colls, m.ns, prog.curr, prog.total, time_used))
-                sys.stdout.flush()
-                del self._ns_map[m.ns]
-
-            # s = ''
-            # for ns, prog in self._ns_map.iteritems():
-            #     s += '|| %s  %d/%d  %.1f%% ' % (ns, prog.curr, prog.total, float(prog.curr)/prog.total*100)
-            # if len(s) > 0:
-            #     s += '||'
-            #     sys.stdout.write('\r%s' % s)
-            #     sys.stdout.flush()
-
-        log.info('ProgressLogger thread %s exit' % threading.currentThread().name)
 
-    def register(self, ns, total):
-        """ Register collection.
-        """
-        if ns in self._ns_map:
-            raise Exception('duplicate collection %s' % ns)
-        self._ns_map[ns] = Progress(ns, total)
-
-    def add(self, ns, count, done=False):
-        """ Update progress.
-        """
-        self._q.put(Message(ns, count, done))
-
-
-class LoggerProcess(multiprocessing.Process):
-    """ Logger progress.
+class ProgressReporter(threading.Thread):
+    """ Sample progress counters periodically, and log throughput and ETA per collection and overall.
     """
-    def __init__(self, n_colls, **kwargs):
+    def __init__(self, counters, n_colls, interval=10, **kwargs):
+        self._counters = counters
         self._n_colls = n_colls
-        self._q = multiprocessing.Queue()
-        self._ns_map = multiprocessing.Manager().dict()
-        super(LoggerProcess, self).__init__(**kwargs)
+        self._n_colls_done = 0
+        self._interval = interval
+        self._ns_map = {}  # ns => Progress, collections in progress
+        self._total = 0  # document count of all collections registered
+        self._docs_done = 0  # document count of collections done
+        self._last_time = time.time()
+        self._stop_event = threading.Event()
+        super(ProgressReporter, self).__init__(**kwargs)
+        self.daemon = True
 
     def run(self):
-        n_colls_done = 0
-        while n_colls_done < self._n_colls:
-            m = self._q.get()
-            if m.ns not in self._ns_map:
-                raise Exception('missing namespace: %s' % m.ns)
-            self._ns_map[m.ns].curr += m.cnt
-            prog = self._ns_map[m.ns]
-            s = '\t%s\t%d/%d\t[%.2f%%]' % (
-                    prog.ns,
-                    prog.curr,
-                    prog.total,
-                    float(prog.curr)/prog.total*100 if prog.total > 0 else float(prog.curr+1)/(prog.total+1)*100)
-
-            if not m.done:
-                log.info(s)
-            else:
-                log.info('[ OK ] ' + s)
-                n_colls_done += 1
-                time_used = time.time() - prog.start_time
-                sys.stdout.write('\r\33[K')
-                sys.stdout.write('\r[\033[32m OK \033[0m]\t[%d/%d]\t%s\t%d/%d\t%.1fs\n' % (n_colls_done, self._n_colls, m.ns, prog.curr, prog.total, time_used))
-                sys.stdout.flush()
-                del self._ns_map[m.ns]
-
-            # s = ''
-            # for ns, prog in self._ns_map.iteritems():
-            #     s += '|| %s  %d/%d  %.1f%% ' % (ns, prog.curr, prog.total, float(prog.curr)/prog.total*100)
-            # if len(s) > 0:
-            #     s += '||'
-            #     sys.stdout.write('\r%s' % s)
-            #     sys.stdout.flush()
-
-        log.info('ProgressLogger process %s exit' % multiprocessing.current_process().name)
+        while not self._stop_event.wait(self._interval):
+            self.report()
+        log.info('ProgressReporter thread %s exit' % threading.currentThread().name)
+
+    def stop(self):
+        self._stop_event.set()
 
     def register(self, ns, total):
         """ Register collection.
@@ -135,8 +94,90 @@ class LoggerProcess(multiprocessing.Process):
         if ns in self._ns_map:
             raise Exception('duplicate collection %s' % ns)
         self._ns_map[ns] = Progress(ns, total)
+        self._total += total
 
-    def add(self, ns, count, done=False):
-        """ Update progress.
+    def done(self, ns):
+        """ Mark collection done.
+        """
+        prog = self._ns_map.pop(ns)
+        docs, nbytes = self._counters.get(ns)
+        self._docs_done += docs
+        self._n_colls_done += 1
+        time_used = time.time() - prog.start_time
+        log.info('[ OK ] \t%s\t%d/%d\t%.1f MB\t%.1fs' % (ns, docs, prog.total, float(nbytes) / 1024 / 1024, time_used))
+        sys.stdout.write('\r\33[K')
+        sys.stdout.write('\r[\033[32m OK \033[0m]\t[%d/%d]\t%s\t%d/%d\t%.1fs\n' % (self._n_colls_done, self._n_colls, ns, docs, prog.total, time_used))
+        sys.stdout.flush()
+
+    def report(self):
+        """ Log progress since the last report.
         """
-        self._q.put(Message(ns, count, done))
+        now = time.time()
+        secs = now - self._last_time
+        if secs <= 0:
+            return
+        self._last_time = now
+
+        docs_all = self._docs_done
+        docs_rate_all = 0.0
+        bytes_rate_all = 0.0
+        for ns, prog in list(self._ns_map.items()):
+            docs, nbytes = self._counters.get(ns)
+            docs_rate = max(0, docs - prog.docs) / secs
+            bytes_rate = max(0, nbytes - prog.nbytes) / secs
+            prog.docs, prog.nbytes = docs, nbytes
+            docs_all += docs
+            docs_rate_all += docs_rate
+            bytes_rate_all += bytes_rate
+            log.info('\t%s\t%d/%d\t[%.2f%%]\t%.0f docs/s\t%.2f MB/s\tETA %s' % (
+                ns,
+                docs,
+                prog.total,
+                float(docs) / prog.total * 100 if prog.total > 0 else 0,
+                docs_rate,
+                bytes_rate / 1024 / 1024,
+                _eta(prog.total - docs, docs_rate)))
+
+        # ETA of all is estimated from collections registered so far
+        log.info('overall\t[%d/%d] collections\t%d/%d docs\t%.0f docs/s\t%.2f MB/s\tETA %s' % (
+            self._n_colls_done,
+            self._n_colls,
+            docs_all,
+            self._total,
+            docs_rate_all,
+            bytes_rate_all / 1024 / 1024,
+            _eta(self._total - docs_all, docs_rate_all)))
+
+
+if __name__ == '__main__':
+    counters = ProgressCounters([('db.small', 1), ('db.large', 3)])
+
+    def copy(index):
+        for i in range(10):
+            counters.add('db.large', index, 100, 1000)
+
+    procs = [multiprocessing.Process(target=copy, args=(i,)) for i in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    counters.add('db.small', 0, 5, 50)
+    assert counters.get('db.large') == (3000, 30000)
+    assert counters.get('db.small') == (5, 50)
+    counters.reset('db.large', 1)
+    assert counters.get('db.large') == (2000, 20000)
+    counters.add('db.large', 1, 1000, 10000)
+
+    assert _eta(100, 0) == '-'
+    assert _eta(7322, 1) == '2:02:02'
+
+    reporter = ProgressReporter(counters, 2)
+    reporter.register('db.small', 5)
+    reporter.register('db.large', 3000)
+    reporter.report()
+    reporter.done('db.small')
+    assert reporter._docs_done == 5
+    assert list(reporter._ns_map.keys()) == ['db.large']
+    assert reporter._ns_map['db.large'].docs == 3000
+
+    print('test cases all pass')
@@ -0,0 +1,154 @@
+import os
+import time
+import bson
+from bson.timestamp import Timestamp
+from mongosync.mongo_utils import gen_namespace
+
+
+class SyncManifest(object):
+    """ Record progress of initial sync in file, so that it could resume after restart.
+
+    The file is a BSON document:
+        {
+            start_optime: Timestamp,
+            done: false,
+            colls: [
+                { ns: 'db.small', done: true },
+                { ns: 'db.large', done: false, points: [...], chunks: [{ done: false, last_id: ..., count: 0 }, ...] }
+            ]
+        }
+
+    Note: chunk checkpoints and small collections done are flushed at most once per flush interval,
+    since they are cheap to copy again, other state changes are flushed at once.
+    """
+    def __init__(self, filepath, flush_interval=5):
+        assert filepath
+        self._filepath = filepath
+        self._flush_interval = flush_interval
+        self._last_flush_time = 0
+        self._doc = None
+        self._colls = {}  # ns => entry in self._doc['colls']
+        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+            with open(filepath, 'rb') as f:
+                self._doc = bson.BSON(f.read()).decode()
+            self._colls = dict((coll['ns'], coll) for coll in self._doc['colls'])
+
+    @property
+    def filepath(self):
+        return self._filepath
+
+    @property
+    def resumable(self):
+        """ Return True if there is an unfinished initial sync.
+        """
+        return self._doc is not None and not self._doc['done']
+
+    @property
+    def start_optime(self):
+        return self._doc['start_optime'] if self._doc else None
+
+    def reset(self, start_optime, large_colls, small_colls):
+        """ Start a new manifest.
+
+        large_colls is a list of (namespace_tuple, split_points), small_colls is a list of namespace_tuple.
+        """
+        colls = []
+        for ns_tuple in small_colls:
+            colls.append({'ns': gen_namespace(*ns_tuple), 'done': False})
+        for ns_tuple, points in large_colls:
+            colls.append({'ns': gen_namespace(*ns_tuple),
+                          'done': False,
+                          'points': points,
+                          'chunks': [{'done': False, 'last_id': None, 'count': 0} for i in range(len(points) + 1)]})
+        self._doc = {'start_optime': start_optime, 'done': False, 'colls': colls}
+        self._colls = dict((coll['ns'], coll) for coll in colls)
+        self.flush()
+
+    def plan(self):
+        """ Return large collections and small collections recorded.
+        """
+        large_colls = []
+        small_colls = []
+        for coll in self._doc['colls']:
+            ns_tuple = tuple(coll['ns'].split('.', 1))
+            if 'points' in coll:
+                large_colls.append((ns_tuple, coll['points']))
+            else:
+                small_colls.append(ns_tuple)
+        return large_colls, small_colls
+
+    def coll_done(self, ns):
+        return self._colls[ns]['done']
+
+    def set_coll_done(self, ns, force=True):
+        """ Mark a collection done, flush it at once if force, otherwise throttle it as chunk checkpoints.
+        """
+        self._colls[ns]['done'] = True
+        self.flush(force)
+
+    def chunk(self, ns, index):
+        """ Return a chunk entry with keys 'done', 'last_id' and 'count'.
+        """
+        return self._colls[ns]['chunks'][index]
+
+    def update_chunk(self, ns, index, last_id, count, done=False):
+        """ Record the last _id copied of a chunk.
+        """
+        chunk = self._colls[ns]['chunks'][index]
+        chunk['last_id'] = last_id
+        chunk['count'] = count
+        chunk['done'] = done
+        if done:
+            self.flush()
+        else:
+            self.flush(force=False)
+
+    def finish(self):
+        self._doc['done'] = True
+        self.flush()
+
+    def flush(self, force=True):
+        """ Write into file atomically.
+        """
+        now = time.time()
+        if not force and now - self._last_flush_time < self._flush_interval:
+            return
+        tmp_filepath = '%s.tmp' % self._filepath
+        with open(tmp_filepath, 'wb') as f:
+            f.write(bson.BSON.encode(self._doc))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_filepath, self._filepath)
+        self._last_flush_time = now
+
+
+if __name__ == '__main__':
+    filepath = 'manifest.tmp'
+    if os.path.exists(filepath):
+        os.remove(filepath)
+
+    manifest = SyncManifest(filepath)
+    assert not manifest.resumable
+    manifest.reset(Timestamp(1, 2), [(('db', 'large'), [10, 20])], [('db', 'small')])
+    manifest.set_coll_done('db.small', force=False)
+    # throttled since the reset just flushed
+    assert not SyncManifest(filepath).coll_done('db.small')
+    manifest.update_chunk('db.large', 0, 5, 5, done=True)
+    manifest.update_chunk('db.large', 1, 15, 5)
+    manifest.flush()
+
+    manifest = SyncManifest(filepath)
+    assert manifest.resumable
+    assert manifest.start_optime == Timestamp(1, 2)
+    assert manifest.plan() == ([(('db', 'large'), [10, 20])], [('db', 'small')])
+    assert manifest.coll_done('db.small')
+    assert not manifest.coll_done('db.large')
+    assert manifest.chunk('db.large', 0) == {'done': True, 'last_id': 5, 'count': 5}
+    assert manifest.chunk('db.large', 1) == {'done': False, 'last_id': 15, 'count': 5}
+    assert manifest.chunk('db.large', 2) == {'done': False, 'last_id': None, 'count': 0}
+    manifest.finish()
+
+    manifest = SyncManifest(filepath)
+    assert not manifest.resumable
+    os.remove(filepath)
+    print('test pass')
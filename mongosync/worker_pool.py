@@ -0,0 +1,155 @@
+import time
+import multiprocessing
+from mongosync.logger import Logger
+
+log = Logger.get()
+
+
+class TaskError(object):
+    """ Message of a task that failed, task is None if a worker died without reporting.
+    """
+    def __init__(self, task, error):
+        self.task = task
+        self.error = error
+
+
+class WorkerPool(object):
+    """ Pool of long-lived worker processes.
+
+    Each worker calls init() once it's started, e.g. to reconnect, and then runs tasks with run(task, report)
+    until the pool is stopped. Messages passed to report() are received by get() in parent process.
+
+    Messages are written to the pipe in report() synchronously. multiprocessing.Queue sends them by a feeder thread,
+    which is a greenlet with gevent monkey patching, and never runs once the worker blocks on the next task.
+    """
+    def __init__(self, n_workers, init, run):
+        assert n_workers > 0
+        self._n_workers = n_workers
+        self._init = init
+        self._run = run
+        self._task_q = multiprocessing.Queue()
+        self._res_q = multiprocessing.SimpleQueue()
+        self._procs = []
+
+    @property
+    def n_workers(self):
+        return self._n_workers
+
+    def start(self):
+        for i in range(self._n_workers):
+            p = multiprocessing.Process(target=self._work)
+            p.daemon = True
+            p.start()
+            self._procs.append(p)
+        log.info('start %d worker processes' % self._n_workers)
+
+    def stop(self):
+        """ Stop workers after all submitted tasks are done.
+        """
+        for p in self._procs:
+            self._task_q.put(None)
+        for p in self._procs:
+            p.join()
+        self._procs = []
+        log.info('stop %d worker processes' % self._n_workers)
+
+    def submit(self, task):
+        self._task_q.put(task)
+
+    def get(self):
+        """ Get a message reported by workers, it's a TaskError if the task failed or a worker died.
+        """
+        while True:
+            # blocking read on the pipe stalls all coroutines, poll it instead
+            if not self._res_q.empty():
+                return self._res_q.get()
+            # e.g. killed by OOM killer, its task would never be reported
+            for p in self._procs:
+                if not p.is_alive():
+                    return TaskError(None, 'worker process %d exited with code %s' % (p.pid, p.exitcode))
+            time.sleep(0.1)
+
+    def _work(self):
+        self._init()
+        while True:
+            task = self._task_q.get()
+            if task is None:
+                break
+            try:
+                self._run(task, self._res_q.put)
+            except Exception as e:
+                log.exception('task failed: %s' % (task,))
+                self._res_q.put(TaskError(task, str(e)))
+            except BaseException as e:
+                # e.g. sys.exit() on write errors, report it before exit
+                log.error('task exited: %s: %r' % (task, e))
+                self._res_q.put(TaskError(task, 'worker exited: %r' % e))
+                raise
+
+
+def _test():
+    import os
+    import sys
+
+    def run(task, report):
+        if task < 0:
+            raise ValueError('negative task')
+        report(task * task)
+
+    pool = WorkerPool(3, lambda: None, run)
+    pool.start()
+    for task in range(10):
+        pool.submit(task)
+    pool.submit(-1)
+    results = [pool.get() for i in range(11)]
+    pool.stop()
+    errors = [res for res in results if isinstance(res, TaskError)]
+    assert len(errors) == 1 and errors[0].task == -1
+    assert sorted([res for res in results if not isinstance(res, TaskError)]) == [i * i for i in range(10)]
+
+    def exit(task, report):
+        if task == 'exit':
+            sys.exit(1)
+        os._exit(1)
+
+    # reported before exit
+    pool = WorkerPool(1, lambda: None, exit)
+    pool.start()
+    pool.submit('exit')
+    res = pool.get()
+    assert isinstance(res, TaskError) and res.task == 'exit'
+
+    # died without reporting
+    pool = WorkerPool(1, lambda: None, exit)
+    pool.start()
+    pool.submit('kill')
+    res = pool.get()
+    assert isinstance(res, TaskError) and res.task is None
+
+    # the last report of a worker arrives while it's waiting for the next task
+    def copy(task, report):
+        time.sleep(0.01)
+        report(('done', task))
+
+    pool = WorkerPool(2, lambda: None, copy)
+    pool.start()
+    for task in range(4):
+        pool.submit(task)
+    results = [pool.get() for i in range(4)]
+    pool.stop()
+    assert sorted(results) == [('done', task) for task in range(4)]
+
+
+if __name__ == '__main__':
+    import sys
+    import subprocess
+
+    if sys.argv[1:] == ['--gevent']:
+        # run as sync.py does, patch before any thread is started
+        from gevent import monkey
+        monkey.patch_all()
+        _test()
+    else:
+        _test()
+        subprocess.check_call([sys.executable, __file__, '--gevent'])
+        print('test cases all pass')